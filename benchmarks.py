@@ -0,0 +1,256 @@
+"""Microbenchmarks for MediaManager.
+
+Run one benchmark by name, or all of them:
+
+    python benchmarks.py connections
+    python benchmarks.py
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from media_manager import MediaManager, _search_query
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def bench_connections(workdir, repeat=2000):
+    db_name = os.path.join(workdir, 'connections.db')
+    manager = MediaManager(db_name)
+    manager.register_user('bench', 'secret')
+
+    # The old access pattern: a fresh connection for every call
+    def reconnect():
+        with sqlite3.connect(db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM users WHERE username = ? AND password = ?', ('bench', 'secret'))
+            cursor.fetchone()
+
+    before = timed(reconnect, repeat)
+    after = timed(lambda: manager.login_user('bench', 'secret'), repeat)
+    manager.close()
+    print(f'per-call overhead: connect per call {before * 1e6:.1f} us, '
+          f'pooled connection {after * 1e6:.1f} us ({before / after:.1f}x)')
+
+def fill_catalogue(manager, size):
+    # Catalogue rows share one small payload so only the metadata grows
+    manager.import_file('pdf', 'title 0', __file__)
+    conn = manager.db.connection()
+    digest = conn.execute('SELECT blob_hash FROM media').fetchone()[0]
+    with conn:
+        conn.executemany('INSERT INTO media (type, title, blob_hash) VALUES (?, ?, ?)',
+                         ((('pdf', 'mp4', 'mp3')[i % 3], f'title {i}', digest) for i in range(1, size)))
+        conn.execute('UPDATE blobs SET refcount = ? WHERE hash = ?', (size, digest))
+
+def bench_lookups(workdir, sizes=(1000, 10000, 100000), repeat=200):
+    for size in sizes:
+        # The payload cache is off so every call measures the database lookup
+        manager = MediaManager(os.path.join(workdir, f'lookups_{size}.db'), auto_compact=False, payload_cache_bytes=0)
+        fill_catalogue(manager, size)
+        titles = [f'title {i * size // repeat}' for i in range(repeat)]
+        lookups = iter(titles * 2)
+        indexed = timed(lambda: manager.get_media_data(next(lookups)), repeat)
+
+        def rename_and_back():
+            title = next(lookups)
+            manager.rename_media(title, 'renamed')
+            manager.rename_media('renamed', title)
+
+        renamed = timed(rename_and_back, repeat // 2) / 2
+        # The same lookups with the indexes gone, as before the migration
+        conn = manager.db.connection()
+        conn.execute('DROP INDEX media_title')
+        conn.execute('DROP INDEX media_type_title')
+        lookups = iter(titles)
+        scanned = timed(lambda: manager.get_media_data(next(lookups)), repeat)
+        manager.close()
+        print(f'{size:>7} titles: get_media_data indexed {indexed * 1e6:8.1f} us, '
+              f'full scan {scanned * 1e6:9.1f} us; rename {renamed * 1e6:7.1f} us')
+
+def bench_batching(workdir, count=2000):
+    def run(name, register, threads=1, group_commit=False):
+        manager = MediaManager(os.path.join(workdir, f'batching_{name}.db'), auto_compact=False)
+        if group_commit:
+            manager.start_group_commit()
+        # The same registrations, spread over the writer threads
+        names = [f'user {i}' for i in range(count)]
+        workers = [threading.Thread(target=register, args=(manager, names[i::threads])) for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        manager.flush()
+        elapsed = time.perf_counter() - start
+        manager.close()
+        return elapsed
+
+    def one_by_one(manager, names):
+        for name in names:
+            manager.register_user(name, 'secret')
+
+    def batched(manager, names):
+        with manager.batch():
+            one_by_one(manager, names)
+
+    single = run('single', one_by_one)
+    batch = run('batch', batched)
+    print(f'{count} registrations, 1 thread:  one transaction each {single * 1e3:7.1f} ms, '
+          f'one batch {batch * 1e3:7.1f} ms ({single / batch:.1f}x)')
+    threaded = run('threaded', one_by_one, threads=8)
+    grouped = run('grouped', one_by_one, threads=8, group_commit=True)
+    print(f'{count} registrations, 8 threads: one transaction each {threaded * 1e3:7.1f} ms, '
+          f'group commit {grouped * 1e3:7.1f} ms ({threaded / grouped:.1f}x)')
+
+def _rival_writer(db_name, count):
+    # A second process with its own writer thread, competing for the same write lock
+    manager = MediaManager(db_name, auto_compact=False)
+    for i in range(count):
+        manager.register_user(f'rival {i}', 'secret')
+    manager.close()
+
+def bench_stress(workdir, readers=16, writes=500, seconds=None):
+    db_name = os.path.join(workdir, 'media_manager.db')
+    manager = MediaManager(db_name, auto_compact=False)
+    fill_catalogue(manager, 1000)
+    rival = multiprocessing.Process(target=_rival_writer, args=(db_name, writes))
+    stop = threading.Event()
+    reads = [0] * readers
+    errors = []
+
+    def read(index):
+        while not stop.is_set():
+            try:
+                manager.search_page(None, 'title', limit=20)
+                manager.get_media_info(f'title {reads[index] % 1000}')
+                reads[index] += 1
+            except Exception as e:
+                errors.append(e)
+
+    def write():
+        for i in range(writes):
+            try:
+                manager.rename_media(f'title {i}', f'renamed {i}')
+                manager.register_user(f'writer {i}', 'secret')
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    writer = threading.Thread(target=write)
+    start = time.perf_counter()
+    rival.start()
+    for thread in threads + [writer]:
+        thread.start()
+    writer.join()
+    rival.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    users = manager.db.connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    renamed = len(manager.search_media(None, 'renamed'))
+    manager.close()
+    print(f'{readers} readers, 1 writer thread and 1 writer process for {elapsed:.1f} s: '
+          f'{sum(reads) / elapsed:.0f} reads/s, {3 * writes / elapsed:.0f} writes/s, {len(errors)} errors')
+    print(f'users {users}/{2 * writes}, renamed {renamed}/{writes}')
+    for error in errors[:5]:
+        print(f'  {error!r}')
+
+def bench_read_scaling(workdir, queries=2000, exports=200):
+    db_name = os.path.join(workdir, 'reads.db')
+    manager = MediaManager(db_name, auto_compact=False)
+    fill_catalogue(manager, 100000)
+    terms = [f'title {i * 37 % 1000}' for i in range(queries)]
+    target = os.path.join(workdir, 'export')
+    start = time.perf_counter()
+    for term in terms:
+        manager.search_media(None, term)
+    baseline = queries / (time.perf_counter() - start)
+    print(f'in process:           {baseline:8.0f} searches/s')
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        with manager.read_service(workers) as service:
+            # Workers are spawned on demand; keep them all busy once so process start-up is not timed
+            for future in [service.executor.submit(time.sleep, 0.5) for _ in range(workers)]:
+                future.result()
+            start = time.perf_counter()
+            for future in [service.search(None, term) for term in terms]:
+                future.result()
+            searches = queries / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for future in [service.export(f'title {i}', f'{target}.{workers}.{i}') for i in range(exports)]:
+                future.result()
+            exported = exports / (time.perf_counter() - start)
+        print(f'{workers:2} worker processes: {searches:8.0f} searches/s, {exported:8.0f} exports/s')
+    print(f'({os.cpu_count()} cores available)')
+    manager.close()
+
+def bench_payload_cache(workdir, items=20, item_size=512 * 1024, reads=2000):
+    for name, budget in (('uncached', 0), ('cached', 64 * 1024 ** 2)):
+        manager = MediaManager(os.path.join(workdir, f'payloads_{name}.db'), auto_compact=False,
+                               payload_cache_bytes=budget)
+        for i in range(items):
+            path = os.path.join(workdir, f'item {i}.pdf')
+            with open(path, 'wb') as file:
+                file.write(b'%PDF-1.4\n' + os.urandom(item_size))
+            manager.import_file('pdf', f'item {i}', path)
+        # A few documents opened over and over
+        titles = iter([f'item {i % items}' for i in range(reads)])
+        elapsed = timed(lambda: manager.get_media_data(next(titles)), reads)
+        print(f'{name:>9}: get_media_data {elapsed * 1e6:8.1f} us per call, {manager.payloads.stats()}')
+        manager.close()
+
+def bench_catalogue(workdir, size=100000, repeat=200):
+    manager = MediaManager(os.path.join(workdir, 'catalogue.db'), auto_compact=False)
+    fill_catalogue(manager, size)
+    conn = manager.db.connection()
+    searches = [('pdf', ''), (None, 'title 12'), ('mp3', 'title 99')]
+    for media_type, title in searches:
+        query, params = _search_query(media_type, title)
+        database = timed(lambda: conn.execute(query, params).fetchall(), repeat // 10)
+        manager.search_media(media_type, title)
+        cached = timed(lambda: manager.search_media(media_type, title), repeat)
+        print(f'{size} titles, search {media_type!s:>4} {title!r:<11}: database {database * 1e6:9.1f} us, '
+              f'catalogue {cached * 1e6:9.1f} us')
+    # After a write only the changed row is read again
+    renames = iter(range(repeat))
+
+    def rename_and_search():
+        i = next(renames)
+        manager.rename_media(f'title {i}', f'renamed {i}')
+        manager.search_media(None, 'renamed')
+
+    refreshed = timed(rename_and_search, repeat // 2)
+    print(f'{size} titles, rename then search: {refreshed * 1e6:9.1f} us')
+    manager.close()
+
+BENCHMARKS = {
+    'connections': bench_connections,
+    'lookups': bench_lookups,
+    'batching': bench_batching,
+    'stress': bench_stress,
+    'reads': bench_read_scaling,
+    'payloads': bench_payload_cache,
+    'catalogue': bench_catalogue,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', help='benchmarks to run: ' + ', '.join(BENCHMARKS))
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark "{name}"')
+    for name in args.names or BENCHMARKS:
+        print(f'== {name}')
+        with tempfile.TemporaryDirectory() as workdir:
+            BENCHMARKS[name](workdir)
+
+if __name__ == '__main__':
+    main()
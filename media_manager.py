@@ -1,19 +1,987 @@
 import os
+import argparse
+import bisect
+import inspect
+import io
+import mmap
+import multiprocessing
+import shutil
+import subprocess
+import sys
+import queue
 import sqlite3
 import tkinter as tk
 from tkinter import Scrollbar, ttk, filedialog, simpledialog
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
 import tempfile
-import mimetypes
+import hashlib
+import hmac
+import json
+import re
+import secrets
+import struct
+import threading
+import time
+
+# Media payloads are streamed in pieces of this size so memory use stays flat
+CHUNK_SIZE = 1024 * 1024
+# Free pages handed back to the filesystem per incremental_vacuum step
+COMPACT_STEP = 256
+# Disk budget for media extracted so external programs can open them
+CACHE_BYTES = 2 * 1024 ** 3
+# A .part file untouched for this long belongs to an abandoned extraction, not one still being written
+STALE_PART_SECONDS = 3600
+# Memory budget for payloads kept by get_media_data, and the largest payload it will keep
+PAYLOAD_CACHE_BYTES = 64 * 1024 ** 2
+PAYLOAD_CACHE_ITEM = 8 * 1024 ** 2
+# Distinct searches whose results the in-memory catalogue keeps between writes, and the most rows they may hold
+CATALOGUE_RESULTS = 64
+CATALOGUE_RESULT_ROWS = 500000
+# Rows fetched per page when search results are browsed incrementally
+SEARCH_PAGE_SIZE = 200
+# Attempts, and the first delay in seconds, when another process keeps the write lock past busy_timeout
+WRITE_RETRIES = 6
+# Largest -wal file kept once checkpointed; writing a payload this big into the database checkpoints straight away
+WAL_SIZE_LIMIT = 32 * 1024 ** 2
+WRITE_BACKOFF = 0.05
+
+# Canonical MIME type and extension for each media type, used when the content gives no better answer
+MEDIA_FORMATS = {
+    "pdf": ("application/pdf", ".pdf"),
+    "mp4": ("video/mp4", ".mp4"),
+    "mp3": ("audio/mpeg", ".mp3"),
+}
+# MP4-family brands that are better described by a more specific format
+_MP4_BRANDS = {
+    b"M4A ": ("audio/mp4", ".m4a"),
+    b"M4B ": ("audio/mp4", ".m4b"),
+    b"qt  ": ("video/quicktime", ".mov"),
+}
+
+MEDIA_FILETYPES = {
+    "pdf": [("PDF files", "*.pdf")],
+    "mp4": [("MP4 files", "*.mp4")],
+    "mp3": [("MP3 files", "*.mp3")]
+}
+
+class OperationCancelled(Exception):
+    pass
+
+def _copy_chunks(source, target, total, progress=None, hasher=None):
+    done = 0
+    while done < total:
+        chunk = source.read(min(CHUNK_SIZE, total - done))
+        if not chunk:
+            raise OSError('Media source ended before all of its data was read')
+        if hasher:
+            hasher.update(chunk)
+        target.write(chunk)
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+    return done
+
+def _fts_phrase(text):
+    # Quote the search text as one FTS5 phrase so operators and punctuation are matched literally
+    return '"' + text.replace('"', '""') + '"'
+
+_PDF_PAGE = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+_PDF_COUNT = re.compile(rb'/Count\s+(\d+)')
+_MP3_BITRATES = {
+    3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def _title_filter(title):
+    # Trigrams need at least three characters; shorter terms fall back to a LIKE scan
+    if len(title) >= 3:
+        return ' AND media.id IN (SELECT rowid FROM media_fts WHERE media_fts MATCH ?)', _fts_phrase(title)
+    return ' AND media.title LIKE ?', '%' + title + '%'
+
+def _title_matcher(title):
+    # The in-memory twin of _title_filter, called with a title and its lowercased form
+    if len(title) >= 3:
+        # The trigram index folds case for every script, so both sides are lowercased in Python
+        term = title.lower()
+        return lambda title, lowered: term in lowered
+    # LIKE's rules: % and _ are wildcards and only ASCII letters match regardless of case
+    pattern = re.compile(''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in title),
+                         re.IGNORECASE | re.ASCII | re.DOTALL)
+    return lambda title, lowered: pattern.search(title) is not None
+
+def _search_query(media_type, title):
+    query = 'SELECT title, type FROM media WHERE 1=1'
+    params = []
+    if media_type:
+        query += ' AND type = ?'
+        params.append(media_type)
+    if title:
+        condition, param = _title_filter(title)
+        query += condition
+        params.append(param)
+    return query, params
+
+def _sniff_format(head, media_type):
+    # Magic bytes first; the declared media type is only the fallback
+    if head.startswith(b'%PDF-'):
+        return MEDIA_FORMATS['pdf']
+    if head[4:8] == b'ftyp':
+        return _MP4_BRANDS.get(head[8:12], MEDIA_FORMATS['mp4'])
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xff and head[1] & 0xe0 == 0xe0):
+        return MEDIA_FORMATS['mp3']
+    return MEDIA_FORMATS.get(media_type, ('application/octet-stream', ''))
+
+def _probe_media(media_type, file, size):
+    # Returns (duration in seconds, page count); whatever cannot be read is None
+    try:
+        if media_type == 'pdf':
+            return None, _pdf_page_count(file, size)
+        if media_type == 'mp4':
+            return _mp4_duration(file, size), None
+        if media_type == 'mp3':
+            return _mp3_duration(file, size), None
+    except (ValueError, IndexError, struct.error):
+        # A damaged or truncated file only loses its metadata; it never fails the ingest
+        pass
+    return None, None
+
+def _pdf_page_count(file, size):
+    pages, largest_count, buffer, done = 0, 0, b'', 0
+    while done < size:
+        chunk = file.read(min(CHUNK_SIZE, size - done))
+        if not chunk:
+            break
+        done += len(chunk)
+        buffer += chunk
+        # Keep a tail so tokens split across chunks are still seen, each exactly once
+        limit = len(buffer) if done >= size else max(0, len(buffer) - 256)
+        pages += sum(1 for match in _PDF_PAGE.finditer(buffer) if match.start() < limit)
+        for match in _PDF_COUNT.finditer(buffer):
+            if match.start() < limit:
+                largest_count = max(largest_count, int(match.group(1)))
+        buffer = buffer[limit:]
+    # Page objects packed into compressed object streams are invisible; fall back to the page tree /Count
+    return pages or largest_count or None
+
+def _mp4_find_box(file, start, end, box_type):
+    offset = start
+    while offset + 8 <= end:
+        file.seek(offset)
+        header = file.read(16)
+        box_size, found_type = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if box_size == 1:
+            box_size, header_size = struct.unpack('>Q', header[8:16])[0], 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header_size:
+            return None
+        if found_type == box_type:
+            return offset + header_size, offset + box_size
+        offset += box_size
+    return None
+
+def _mp4_duration(file, size):
+    moov = _mp4_find_box(file, 0, size, b'moov')
+    mvhd = moov and _mp4_find_box(file, moov[0], moov[1], b'mvhd')
+    if not mvhd:
+        return None
+    file.seek(mvhd[0])
+    header = file.read(32)
+    if len(header) < 20 or header[0] == 1 and len(header) < 32:
+        return None
+    if header[0] == 1:
+        timescale, duration = struct.unpack('>IQ', header[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', header[12:20])
+    return duration / timescale if timescale else None
+
+def _mp3_duration(file, size):
+    file.seek(0)
+    start = 0
+    header = file.read(10)
+    if header[:3] == b'ID3' and len(header) == 10:
+        start = 10 + ((header[6] & 0x7f) << 21 | (header[7] & 0x7f) << 14 | (header[8] & 0x7f) << 7 | header[9] & 0x7f)
+        if header[5] & 0x10:
+            start += 10
+    file.seek(start)
+    data = file.read(4096)
+    for i in range(len(data) - 4):
+        if data[i] != 0xff or data[i + 1] & 0xe0 != 0xe0:
+            continue
+        version, layer = data[i + 1] >> 3 & 3, data[i + 1] >> 1 & 3
+        bitrate_index, rate_index = data[i + 2] >> 4, data[i + 2] >> 2 & 3
+        # Only well-formed MPEG Layer III frame headers
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        bitrate = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        samples = 1152 if version == 3 else 576
+        mono = data[i + 3] >> 6 == 3
+        # A Xing/Info header after the side information gives the exact frame count for VBR files
+        xing = i + 4 + ((17 if mono else 32) if version == 3 else (9 if mono else 17))
+        if data[xing:xing + 4] in (b'Xing', b'Info') and len(data) >= xing + 12 and data[xing + 7] & 1:
+            frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+            return frames * samples / sample_rate
+        return (size - start - i) * 8 / bitrate
+    return None
+
+def _locate_media(cursor, title):
+    cursor.execute('''
+        SELECT blobs.data_id, blobs.path, blobs.size FROM media
+        JOIN blobs ON blobs.hash = media.blob_hash
+        WHERE media.title = ?
+    ''', (title,))
+    return cursor.fetchone()
+
+def _open_payload(conn, object_dir, data_id, path):
+    if path:
+        return open(os.path.join(object_dir, path), 'rb')
+    return conn.blobopen('blob_data', 'data', data_id, readonly=True)
+
+def _hash_file(file):
+    hasher = hashlib.sha256()
+    while chunk := file.read(CHUNK_SIZE):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+class ConnectionManager:
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.closed = False
+
+    def connection(self):
+        # Each thread keeps one tuned connection instead of reconnecting on every call
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            with self.lock:
+                if self.closed:
+                    raise sqlite3.ProgrammingError('Connection manager is closed.')
+                conn = sqlite3.connect(self.db_name, check_same_thread=False)
+                self.connections.append(conn)
+            conn.execute('PRAGMA journal_mode = WAL')
+            # NORMAL only syncs at checkpoints, which is still durable against application crashes in WAL mode
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute(f'PRAGMA journal_size_limit = {WAL_SIZE_LIMIT}')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            conn.execute('PRAGMA cache_size = -16384')
+            conn.execute('PRAGMA mmap_size = 268435456')
+            conn.execute('PRAGMA temp_store = MEMORY')
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+
+    def release(self):
+        # Short-lived threads close their connection when done instead of leaving it until close()
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            self.local.conn = None
+            with self.lock:
+                if conn in self.connections:
+                    self.connections.remove(conn)
+            conn.close()
+
+    def in_unit(self):
+        return getattr(self.local, 'depth', 0) > 0
+
+    def begin(self, immediate=False):
+        # Units of work nest per thread: the outermost one owns the transaction, inner ones are savepoints
+        conn = self.connection()
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            self.local.after_commit = []
+            self.local.after_rollback = []
+            self.local.marks = []
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        else:
+            conn.execute(f'SAVEPOINT unit_{depth}')
+            self.local.marks.append((len(self.local.after_commit), len(self.local.after_rollback)))
+        self.local.depth = depth + 1
+        return conn
+
+    def commit(self):
+        conn = self.local.conn
+        self.local.depth -= 1
+        if self.local.depth:
+            conn.execute(f'RELEASE unit_{self.local.depth}')
+            self.local.marks.pop()
+            return
+        try:
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            self.local.after_commit = []
+            self._run_after_rollback(0)
+            raise
+        self.local.after_rollback = []
+        callbacks, self.local.after_commit = self.local.after_commit, []
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        conn = self.local.conn
+        self.local.depth -= 1
+        if self.local.depth:
+            conn.execute(f'ROLLBACK TO unit_{self.local.depth}')
+            conn.execute(f'RELEASE unit_{self.local.depth}')
+            committed, rolled_back = self.local.marks.pop()
+            del self.local.after_commit[committed:]
+            self._run_after_rollback(rolled_back)
+            return
+        conn.rollback()
+        self.local.after_commit = []
+        self._run_after_rollback(0)
+
+    def _run_after_rollback(self, mark):
+        # Newest first, undoing the rolled-back unit's side effects in reverse
+        callbacks = self.local.after_rollback[mark:]
+        del self.local.after_rollback[mark:]
+        for callback in reversed(callbacks):
+            callback()
+
+    def after_commit(self, callback):
+        # Side effects outside the database (removing object files) wait until the outermost commit
+        if self.in_unit():
+            self.local.after_commit.append(callback)
+        else:
+            callback()
+
+    def after_rollback(self, callback):
+        # Undoes a side effect already made outside the database (placing an object file) if the unit
+        # making it is rolled back; outside a unit nothing can be rolled back
+        if self.in_unit():
+            self.local.after_rollback.append(callback)
+
+    def transaction(self):
+        return UnitOfWork(self)
+
+class UnitOfWork:
+
+    def __init__(self, db):
+        # Usable as a context manager, or held as a batch object and finished with commit() or rollback()
+        self.db = db
+        self.conn = db.begin()
+        self.active = True
+
+    def commit(self):
+        if self.active:
+            self.active = False
+            self.db.commit()
+
+    def rollback(self):
+        if self.active:
+            self.active = False
+            self.db.rollback()
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type:
+            self.rollback()
+        else:
+            self.commit()
+
+class MediaWriter:
+
+    def __init__(self, db):
+        # The only thread that writes: mutations from every other thread are queued here and run in order
+        self.db = db
+        self.queue = queue.Queue()
+        self.local = threading.local()
+        # One mutation per commit by default; group commit raises these
+        self.interval = 0
+        self.max_ops = 1
+        self.pending = 0
+        self.deadline = None
+        # (future, result) of mutations in the open group, reported once it commits
+        self.waiting = []
+        # Set while a batch holds the writer; its own commit ends the group
+        self.serving = False
+        self.thread = threading.Thread(target=self.run, name='media-writer', daemon=True)
+        self.thread.start()
+
+    def in_writer(self):
+        return threading.current_thread() is self.thread
+
+    def call(self, func, *args):
+        # Runs func(*args) on the writer; inside a batch it goes to that batch's queue instead
+        if self.in_writer():
+            return func(*args)
+        return self.submit(getattr(self.local, 'batch', None) or self.queue, func, *args).result()
+
+    def submit(self, target, func, *args):
+        future = Future()
+        target.put((func, args, future))
+        return future
+
+    def write(self, func, *args):
+        return self.call(self._unit, func, args)
+
+    def _unit(self, func, args):
+        self._open_group()
+        self.pending += 1
+        with self.db.transaction() as conn:
+            return func(conn, *args)
+
+    def _open_group(self):
+        if self.deadline is not None:
+            return
+        # BEGIN IMMEDIATE takes the write lock up front, so busy_timeout covers it;
+        # another process holding the lock for longer is retried with backoff
+        delay = WRITE_BACKOFF
+        for attempt in range(WRITE_RETRIES):
+            try:
+                self.db.begin(immediate=True)
+                break
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+        self.deadline = time.monotonic() + self.interval
+
+    def _commit_group(self):
+        if self.deadline is None or self.serving:
+            return None
+        waiting, self.waiting = self.waiting, []
+        self.pending = 0
+        self.deadline = None
+        try:
+            self.db.commit()
+        except sqlite3.Error as e:
+            # The whole group was rolled back, so none of its mutations happened
+            for future, _ in waiting:
+                future.set_exception(e)
+            return e
+        for future, result in waiting:
+            future.set_result(result)
+        return None
+
+    def _overdue(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _serve_batch(self, batch_queue):
+        # Holds the writer for one caller's batch; it ends when the batch's own unit is committed or rolled back
+        try:
+            self._open_group()
+        except BaseException as e:
+            # The caller is already waiting on the batch's opening call; failing it makes MediaBatch raise
+            _, _, future = batch_queue.get()
+            future.set_exception(e)
+            return
+        base = self.db.local.depth
+        self.serving = True
+        try:
+            while True:
+                func, args, future = batch_queue.get()
+                try:
+                    future.set_result(func(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+                if self.db.local.depth == base:
+                    break
+        finally:
+            self.serving = False
+
+    def _set_policy(self, interval, max_ops):
+        self.interval = interval
+        self.max_ops = max_ops
+        return self._commit_group()
+
+    def run(self):
+        while True:
+            timeout = None if self.deadline is None else max(0, self.deadline - time.monotonic())
+            try:
+                func, args, future = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                # The group-commit interval ran out
+                self._commit_group()
+                continue
+            if func is None:
+                future.set_result(self._commit_group())
+                break
+            try:
+                result = func(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                if self.deadline is None:
+                    future.set_result(result)
+                else:
+                    # A caller only hears back once its change is committed, so it always reads its own writes
+                    self.waiting.append((future, result))
+            # Callers are blocked until their group commits, so it ends as soon as nobody else is queued
+            if self.pending >= self.max_ops or self.queue.empty() or self._overdue():
+                self._commit_group()
+
+    def set_policy(self, interval, max_ops):
+        error = self.call(self._set_policy, interval, max_ops)
+        if error:
+            raise error
+
+    def flush(self):
+        # Commits whatever group is open; its mutations' callers get any commit error as well
+        error = self.call(self._commit_group)
+        if error:
+            raise error
+
+    def stop(self):
+        self.submit(self.queue, None).result()
+        self.thread.join()
+
+class MediaBatch:
+
+    def __init__(self, writer):
+        # Usable as a context manager, or held as a batch object and finished with commit() or rollback().
+        # Until then the writer serves only this thread, so keep batches short
+        self.writer = writer
+        self.outer = getattr(writer.local, 'batch', None) is None
+        if self.outer:
+            writer.local.batch = queue.Queue()
+            self.done = writer.submit(writer.queue, writer._serve_batch, writer.local.batch)
+        self.active = True
+        try:
+            writer.call(writer.db.begin)
+        except BaseException:
+            self._end()
+            raise
+
+    def commit(self):
+        self._finish(self.writer.db.commit)
+
+    def rollback(self):
+        self._finish(self.writer.db.rollback)
+
+    def _finish(self, end):
+        if self.active:
+            self.active = False
+            try:
+                self.writer.call(end)
+            finally:
+                self._end()
+
+    def _end(self):
+        if self.outer:
+            self.writer.local.batch = None
+            self.done.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type:
+            self.rollback()
+        else:
+            self.commit()
+
+class BlobReader(io.RawIOBase):
+
+    def __init__(self, db_name, data_id):
+        # A private connection keeps the BLOB handle valid however the manager's connections are used
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.blob = self.conn.blobopen('blob_data', 'data', data_id, readonly=True)
+        self.size = len(self.blob)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.blob.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.blob.seek(offset, whence)
+        return self.blob.tell()
+
+    def tell(self):
+        return self.blob.tell()
+
+    def close(self):
+        if not self.closed:
+            self.blob.close()
+            self.conn.close()
+        super().close()
+
+class ExtractionCache:
+
+    def __init__(self, directory, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Cached file name -> size, least recently used first
+        self.entries = OrderedDict()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._check_owner()
+        self.cleanup()
+
+    def _check_owner(self):
+        # Extracted files are handed to an external program, so nobody else may be able to plant or swap them
+        if not hasattr(os, 'getuid'):
+            return
+        stat = os.stat(self.directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise PermissionError(f'Cache directory {self.directory} must be owned by this user '
+                                  f'and not writable by others')
+
+    def cleanup(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            # Partial files are left behind by extractions that never finished; recent ones may
+            # still be written by another instance sharing the directory
+            if name.endswith('.part'):
+                try:
+                    if time.time() - os.stat(path).st_mtime > STALE_PART_SECONDS:
+                        self._remove(path)
+                except OSError:
+                    pass
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        with self.lock:
+            self.entries.clear()
+            for _, name, size in sorted(files):
+                self.entries[name] = size
+            self._evict()
+
+    def extract(self, digest, extension, write, progress=None):
+        name = digest + extension
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            if name in self.entries and os.path.exists(path):
+                self.entries.move_to_end(name)
+                os.utime(path)
+                return path
+        # Extract outside the lock; a concurrent extraction of the same item just replaces it
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.part', delete=False) as tmp_file:
+            try:
+                # write returns False when the content is gone; nothing is cached for it then
+                if write(tmp_file, progress) is False:
+                    raise FileNotFoundError(f'Media content {digest} is no longer stored')
+            except BaseException:
+                tmp_file.close()
+                self._remove(tmp_file.name)
+                raise
+        os.replace(tmp_file.name, path)
+        with self.lock:
+            self.entries[name] = os.path.getsize(path)
+            self.entries.move_to_end(name)
+            self._evict()
+        return path
+
+    def _evict(self):
+        total = sum(self.entries.values())
+        # The most recent entry always stays, even when it alone is over budget
+        while total > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Still open in a player on platforms that lock open files; a later cleanup retries
+            pass
+
+class PayloadCache:
+
+    def __init__(self, max_bytes=PAYLOAD_CACHE_BYTES, max_item=PAYLOAD_CACHE_ITEM):
+        self.max_bytes = max_bytes
+        # Anything larger bypasses the cache, so one big video cannot push out everything else
+        self.max_item = max_item
+        self.lock = threading.Lock()
+        # Title -> (content hash, payload), least recently used first; another process may change
+        # a title without invalidating it here, so an entry is only served for the hash it was read as
+        self.entries = OrderedDict()
+        self.size = 0
+        # Bumped by every invalidation, so a read that raced one is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+
+    def get(self, title, digest):
+        with self.lock:
+            entry = self.entries.get(title)
+            if entry is None or entry[0] != digest:
+                self.misses += 1
+                return None, self.generation
+            self.entries.move_to_end(title)
+            self.hits += 1
+            return entry[1], self.generation
+
+    def fits(self, size):
+        if size <= self.max_item and size <= self.max_bytes:
+            return True
+        with self.lock:
+            self.bypasses += 1
+        return False
+
+    def put(self, title, digest, data, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            stale = self.entries.pop(title, None)
+            if stale is not None:
+                self.size -= len(stale[1])
+            self.entries[title] = (digest, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, titles):
+        with self.lock:
+            self.generation += 1
+            for title in titles:
+                entry = self.entries.pop(title, None)
+                if entry is not None:
+                    self.size -= len(entry[1])
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'bypasses': self.bypasses,
+                    'entries': len(self.entries), 'bytes': self.size}
+
+class MediaCatalogue:
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        # Media id -> (title, type, size, mtime, duration, page_count, mime, lowercased title), in id order
+        self.rows = {}
+        self.revision = None
+        # Recent search results for the current revision, and how many rows they hold together
+        self.results = OrderedDict()
+        self.result_rows = 0
+
+    def refresh(self):
+        conn = self.db.connection()
+        revision = conn.execute('SELECT value FROM media_revision').fetchone()[0]
+        with self.lock:
+            if revision == self.revision:
+                return
+            columns = 'id, title, type, size, mtime, duration, page_count, mime'
+            if self.revision is None:
+                self.rows = {row[0]: row[1:] + (row[1].lower(),)
+                             for row in conn.execute(f'SELECT {columns} FROM media ORDER BY id')}
+            else:
+                # Only rows changed since the last refresh are read again; re-applying one twice is harmless
+                changed = [media_id for media_id, in conn.execute('''
+                    SELECT media_id FROM media_changes WHERE revision > ? ORDER BY media_id
+                ''', (self.revision,))]
+                live = {row[0]: row[1:] + (row[1].lower(),) for row in conn.execute(f'''
+                    SELECT {columns} FROM media WHERE id IN (SELECT value FROM json_each(?))
+                ''', (json.dumps(changed),))}
+                for media_id in changed:
+                    # New ids are always the largest, so assignment keeps the id order
+                    if media_id in live:
+                        self.rows[media_id] = live[media_id]
+                    else:
+                        self.rows.pop(media_id, None)
+            self.revision = revision
+            self.results.clear()
+            self.result_rows = 0
+
+    def search(self, media_type, title):
+        self.refresh()
+        with self.lock:
+            return list(self._matches(media_type, title, False))
+
+    def page(self, media_type, title, after=None, limit=SEARCH_PAGE_SIZE):
+        # The same keyset pages as an ORDER BY title query; str order is UTF-8 byte order, as SQLite sorts
+        self.refresh()
+        with self.lock:
+            rows = self._matches(media_type, title, True)
+            start = 0 if after is None else bisect.bisect_right(rows, after, key=lambda row: row[0])
+            return rows[start:start + limit]
+
+    def _matches(self, media_type, title, ordered):
+        key = (media_type, title, ordered)
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+        match = _title_matcher(title) if title else None
+        rows = [(row[0], row[1]) for row in self.rows.values()
+                if (not media_type or row[1] == media_type) and (not match or match(row[0], row[-1]))]
+        if ordered:
+            rows.sort()
+        self.results[key] = rows
+        self.result_rows += len(rows)
+        while len(self.results) > CATALOGUE_RESULTS or self.result_rows > CATALOGUE_RESULT_ROWS:
+            _, evicted = self.results.popitem(last=False)
+            self.result_rows -= len(evicted)
+        return rows
+
+class StartfileOpener:
+
+    def available(self):
+        return hasattr(os, 'startfile')
+
+    def launch(self, target):
+        os.startfile(target)
+
+class CommandOpener:
+
+    def __init__(self, command):
+        self.command = command
+
+    def available(self):
+        return shutil.which(self.command) is not None
+
+    def launch(self, target):
+        # Started detached and never waited on, so a slow player cannot block the caller
+        subprocess.Popen([shutil.which(self.command), target], stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def default_opener():
+    if hasattr(os, 'startfile'):
+        return StartfileOpener()
+    if sys.platform == 'darwin':
+        return CommandOpener('open')
+    return CommandOpener('xdg-open')
+
+class CompactionScheduler:
+
+    def __init__(self, manager, idle_delay=5.0, threshold=4096, step=COMPACT_STEP):
+        self.manager = manager
+        # Free pages are reclaimed once writes have been quiet for idle_delay seconds,
+        # or straight away while more than threshold pages are free
+        self.idle_delay = idle_delay
+        self.threshold = threshold
+        self.step = step
+        self.last_activity = time.monotonic()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='media-compaction', daemon=True)
+        self.thread.start()
+
+    def notify(self):
+        self.last_activity = time.monotonic()
+        self.wake.set()
+
+    def run(self):
+        delay = self.idle_delay
+        while not self.stopped.is_set():
+            self.wake.wait(delay)
+            self.wake.clear()
+            if self.stopped.is_set():
+                break
+            delay = self.idle_delay
+            try:
+                free = self.manager.free_pages()
+                idle = time.monotonic() - self.last_activity >= self.idle_delay
+                if free and (idle or free >= self.threshold):
+                    # One bounded step at a time so writers are never held up for long
+                    self.manager.compact(max_pages=self.step, step=self.step)
+                    if free > self.step:
+                        delay = 0
+            except sqlite3.Error:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        self.thread.join()
 
 class MediaManager:
     
-    def __init__(self):
-        self.db_name = 'media_manager.db'
+    def __init__(self, db_name='media_manager.db', storage='sqlite', object_dir=None, auto_compact=True,
+                 cache_dir=None, cache_bytes=CACHE_BYTES, opener=None, payload_cache_bytes=PAYLOAD_CACHE_BYTES):
+        if storage not in ('sqlite', 'file'):
+            raise ValueError(f'Unknown storage backend "{storage}"')
+        self.db_name = db_name
+        # 'sqlite' keeps payloads inside the database, 'file' keeps them in a sharded object directory
+        self.storage = storage
+        self.object_dir = object_dir or os.path.splitext(db_name)[0] + '_objects'
+        self.db = ConnectionManager(db_name)
         self.setup_database()
+        self.server = None
+        # Schema setup above runs before it starts; from here on every mutation goes through the writer thread
+        self.writer = MediaWriter(self.db)
+        self.compactor = CompactionScheduler(self) if auto_compact else None
+        # Anything with available() and launch(target) can stand in for the platform opener
+        self.opener = opener or default_opener()
+        # Kept next to the database, like the object directory, rather than in a shared temp directory
+        self.cache = ExtractionCache(cache_dir or os.path.splitext(db_name)[0] + '_cache', cache_bytes)
+        self.payloads = PayloadCache(payload_cache_bytes)
+        self.catalogue = MediaCatalogue(self.db)
+
+    def close(self):
+        if self.server:
+            self.server.stop()
+            self.server = None
+        if self.compactor:
+            self.compactor.stop()
+        self.writer.stop()
+        self.db.close()
+
+    def read_service(self, workers=None):
+        # Searches and exports on a pool of worker processes, each with its own read-only connection
+        return ReadService(self.db_name, self.object_dir, workers)
+
+    def start_media_server(self, host='127.0.0.1', port=0):
+        if not self.server:
+            self.server = MediaServer(self, host, port)
+        return self.server
+
+    def batch(self):
+        # Mutations made on this thread inside the batch share one transaction
+        if self.writer.in_writer():
+            return self.db.transaction()
+        return MediaBatch(self.writer)
+
+    def start_group_commit(self, interval=0.05, max_ops=100):
+        # Mutations queued together then share one commit, each returning once its group has committed.
+        # A group ends when the queue drains, after max_ops mutations or after interval seconds
+        self.writer.set_policy(interval, max_ops)
+
+    def stop_group_commit(self):
+        self.writer.set_policy(0, 1)
+
+    def flush(self):
+        self.writer.flush()
+
+    def _write(self, func, *args):
+        return self.writer.write(func, *args)
 
     def setup_database(self):
-        with sqlite3.connect(self.db_name) as conn:
+        with self.db.connection() as conn:
             cursor = conn.cursor()
+            # Deletes leave free pages behind for compact() instead of rewriting the whole file
+            if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                # VACUUM cannot run inside a transaction, so wait out any instance rebuilding the file
+                # right now and only rebuild if it still needs it
+                cursor.execute('BEGIN IMMEDIATE')
+                mode = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+                conn.rollback()
+                if mode != 2:
+                    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    # Existing databases only switch modes after one full rebuild
+                    cursor.execute('VACUUM')
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS media (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -29,113 +997,987 @@ class MediaManager:
                     password TEXT NOT NULL
                 )
             ''')
+            # Schema changes are applied in order and tracked in user_version
+            migrations = [
+                self._migrate_content_addressed,
+                self._migrate_external_objects,
+                self._migrate_import_log,
+                self._migrate_title_indexes,
+                self._migrate_title_search,
+                self._migrate_media_metadata,
+                self._migrate_media_formats,
+                self._migrate_change_log,
+            ]
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            if version < len(migrations):
+                # Another instance may be migrating the same file: take the write lock, then look again
+                cursor.execute('BEGIN IMMEDIATE')
+                version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            for number, migrate in enumerate(migrations[version:], start=version + 1):
+                migrate(conn)
+                cursor.execute(f'PRAGMA user_version = {number}')
             conn.commit()
 
+    def _migrate_content_addressed(self, conn):
+        cursor = conn.cursor()
+        # Payloads live in blob_data, apart from the refcounted blobs row, so
+        # bumping a refcount never rewrites the payload's overflow pages
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL,
+                data_id INTEGER
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blob_data (
+                id INTEGER PRIMARY KEY,
+                data BLOB
+            )
+        ''')
+        cursor.execute('ALTER TABLE media ADD COLUMN blob_hash TEXT')
+        # Move payloads stored inline in media.data into the blob store. This runs against the
+        # schema as it stood at this version, so it cannot use _store_blob and its later columns
+        cursor.execute('SELECT id FROM media WHERE data IS NOT NULL')
+        for (media_id,) in cursor.fetchall():
+            hasher = hashlib.sha256()
+            with conn.blobopen('media', 'data', media_id, readonly=True) as source:
+                size = len(source)
+                cursor.execute('INSERT INTO blob_data (data) VALUES (zeroblob(?))', (size,))
+                data_id = cursor.lastrowid
+                with conn.blobopen('blob_data', 'data', data_id) as blob:
+                    _copy_chunks(source, blob, size, hasher=hasher)
+            digest = hasher.hexdigest()
+            cursor.execute('UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?', (digest,))
+            if cursor.rowcount:
+                cursor.execute('DELETE FROM blob_data WHERE id = ?', (data_id,))
+            else:
+                cursor.execute('INSERT INTO blobs (hash, size, refcount, data_id) VALUES (?, ?, 1, ?)',
+                               (digest, size, data_id))
+            cursor.execute('UPDATE media SET data = NULL, blob_hash = ? WHERE id = ?', (digest, media_id))
+
+    def _migrate_external_objects(self, conn):
+        # Relative path of the payload inside object_dir when it is kept outside the database
+        conn.execute('ALTER TABLE blobs ADD COLUMN path TEXT')
+
+    def _migrate_import_log(self, conn):
+        # Source files already taken in by import_directory, so an interrupted import can resume
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS imports (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                title TEXT NOT NULL
+            )
+        ''')
+
+    def _migrate_title_indexes(self, conn):
+        cursor = conn.cursor()
+        # Titles were never enforced unique; keep the oldest row and number later duplicates
+        cursor.execute('''
+            SELECT id, title FROM media
+            WHERE title IN (SELECT title FROM media GROUP BY title HAVING COUNT(*) > 1)
+            ORDER BY title, id
+        ''')
+        previous = None
+        for media_id, title in cursor.fetchall():
+            if title != previous:
+                previous, number = title, 1
+                continue
+            while True:
+                number += 1
+                new_title = f'{title} ({number})'
+                if not conn.execute('SELECT 1 FROM media WHERE title = ?', (new_title,)).fetchone():
+                    break
+            conn.execute('UPDATE media SET title = ? WHERE id = ?', (new_title, media_id))
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS media_title ON media (title)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS media_type_title ON media (type, title)')
+
+    def _migrate_title_search(self, conn):
+        cursor = conn.cursor()
+        # Trigram tokens give substring matches, including CJK titles without word breaks
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+                title, content='media', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+        self._create_title_search_triggers(conn)
+        cursor.execute("INSERT INTO media_fts (media_fts) VALUES ('rebuild')")
+
+    def _create_title_search_triggers(self, conn):
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS media_fts_insert AFTER INSERT ON media BEGIN
+                INSERT INTO media_fts (rowid, title) VALUES (new.id, new.title);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS media_fts_delete AFTER DELETE ON media BEGIN
+                INSERT INTO media_fts (media_fts, rowid, title) VALUES ('delete', old.id, old.title);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS media_fts_rename AFTER UPDATE OF title ON media BEGIN
+                INSERT INTO media_fts (media_fts, rowid, title) VALUES ('delete', old.id, old.title);
+                INSERT INTO media_fts (rowid, title) VALUES (new.id, new.title);
+            END
+        ''')
+
+    def _migrate_media_metadata(self, conn):
+        cursor = conn.cursor()
+        # media keeps only narrow metadata rows; every payload already lives in the blob store
+        cursor.execute('ALTER TABLE media DROP COLUMN data')
+        for column in ('size INTEGER', 'mtime REAL', 'duration REAL', 'page_count INTEGER'):
+            cursor.execute(f'ALTER TABLE media ADD COLUMN {column}')
+        cursor.execute('CREATE INDEX IF NOT EXISTS media_blob_hash ON media (blob_hash)')
+        cursor.execute('''
+            SELECT media.id, media.type, blobs.data_id, blobs.path, blobs.size FROM media
+            JOIN blobs ON blobs.hash = media.blob_hash
+        ''')
+        for media_id, media_type, data_id, path, size in cursor.fetchall():
+            try:
+                with self._open_payload(conn, data_id, path) as payload:
+                    duration, page_count = _probe_media(media_type, payload, size)
+            except OSError:
+                duration, page_count = None, None
+            conn.execute('UPDATE media SET size = ?, duration = ?, page_count = ? WHERE id = ?',
+                         (size, duration, page_count, media_id))
+
+    def _migrate_media_formats(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('ALTER TABLE media ADD COLUMN mime TEXT')
+        cursor.execute('ALTER TABLE media ADD COLUMN extension TEXT')
+        cursor.execute('''
+            SELECT media.id, media.type, blobs.data_id, blobs.path FROM media
+            JOIN blobs ON blobs.hash = media.blob_hash
+        ''')
+        for media_id, media_type, data_id, path in cursor.fetchall():
+            try:
+                with self._open_payload(conn, data_id, path) as payload:
+                    head = payload.read(64)
+            except OSError:
+                head = b''
+            conn.execute('UPDATE media SET mime = ?, extension = ? WHERE id = ?',
+                         _sniff_format(head, media_type) + (media_id,))
+
+    def _migrate_change_log(self, conn):
+        cursor = conn.cursor()
+        # Every change to a media row bumps the revision and records it against the row's id
+        cursor.execute('CREATE TABLE media_revision (value INTEGER NOT NULL)')
+        cursor.execute('INSERT INTO media_revision (value) VALUES (0)')
+        cursor.execute('''
+            CREATE TABLE media_changes (
+                media_id INTEGER PRIMARY KEY,
+                revision INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX media_changes_revision ON media_changes (revision)')
+        for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')):
+            cursor.execute(f'''
+                CREATE TRIGGER media_changes_{event.lower()} AFTER {event} ON media BEGIN
+                    UPDATE media_revision SET value = value + 1;
+                    INSERT OR REPLACE INTO media_changes (media_id, revision)
+                        SELECT {row}.id, value FROM media_revision;
+                END
+            ''')
+
+    def _store_blob(self, conn, source, total, progress=None, digest=None):
+        cursor = conn.cursor()
+        # A hash computed up front lets known content skip the write entirely
+        if digest:
+            cursor.execute('UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?', (digest,))
+            if cursor.rowcount:
+                return digest
+        hasher = hashlib.sha256()
+        # Stream into a fresh payload while hashing, then keep it only if the content is new
+        if self.storage == 'file':
+            data_id, tmp_path = None, self._write_object(source, total, progress, hasher)
+        else:
+            cursor.execute('INSERT INTO blob_data (data) VALUES (zeroblob(?))', (total,))
+            data_id, tmp_path = cursor.lastrowid, None
+            with conn.blobopen('blob_data', 'data', data_id) as blob:
+                _copy_chunks(source, blob, total, progress, hasher)
+            if total >= WAL_SIZE_LIMIT:
+                # Otherwise the -wal file stays as large as the payload until the last connection closes
+                self.db.after_commit(self._checkpoint)
+        return self._adopt_blob(conn, hasher.hexdigest(), total, data_id, tmp_path)
+
+    def _adopt_blob(self, conn, digest, total, data_id=None, tmp_path=None):
+        # Keeps a freshly written payload only if the content is new; otherwise takes another reference
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,))
+        if cursor.fetchone():
+            if tmp_path:
+                os.remove(tmp_path)
+            else:
+                cursor.execute('DELETE FROM blob_data WHERE id = ?', (data_id,))
+            cursor.execute('UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?', (digest,))
+        else:
+            path = None
+            if tmp_path:
+                path = os.path.join(digest[:2], digest[2:4], digest)
+                object_path = os.path.join(self.object_dir, path)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(tmp_path, object_path)
+                # A rolled-back unit leaves no blobs row, and the file would be orphaned
+                self.db.after_rollback(lambda: self._remove_objects([path]))
+            cursor.execute('INSERT INTO blobs (hash, size, refcount, data_id, path) VALUES (?, ?, 1, ?, ?)',
+                           (digest, total, data_id, path))
+        return digest
+
+    def _stage_import(self, conn, media_type, file_path, total, progress=None):
+        # Runs before the writer is involved: an object file is copied and the media probed here, so a
+        # long copy never holds the database write lock. In-database payloads can only be copied by the
+        # writer, so they are just hashed, which lets the writer skip content it already has
+        tmp_path = None
+        with open(file_path, 'rb') as file:
+            if self.storage == 'file':
+                hasher = hashlib.sha256()
+                tmp_path = self._write_object(file, total, progress, hasher)
+                digest = hasher.hexdigest()
+            else:
+                digest = _hash_file(file)
+            try:
+                fields = self._describe_media(conn, media_type, file, total, digest)
+            except BaseException:
+                self._discard_staged((digest, tmp_path, None))
+                raise
+        return digest, tmp_path, fields
+
+    def _discard_staged(self, staged):
+        # Nothing is left once the writer moved the object into place
+        if staged[1]:
+            try:
+                os.remove(staged[1])
+            except FileNotFoundError:
+                pass
+
+    def _ingest(self, conn, media_type, file_path, total, progress=None, staged=None):
+        # Returns the stored content's hash and the media row fields
+        if staged:
+            digest, tmp_path, fields = staged
+            if tmp_path or conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone():
+                return self._adopt_blob(conn, digest, total, tmp_path=tmp_path), fields
+            # New in-database content, or known content dropped since staging: copy it now
+            with open(file_path, 'rb') as file:
+                return self._store_blob(conn, file, total, progress, digest), fields
+        with open(file_path, 'rb') as file:
+            digest = self._store_blob(conn, file, total, progress)
+            return digest, self._describe_media(conn, media_type, file, total, digest)
+
+    def _write_object(self, source, total, progress, hasher):
+        # Objects are written under tmp/ and only renamed into place once complete
+        tmp_dir = os.path.join(self.object_dir, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp_file:
+            try:
+                _copy_chunks(source, tmp_file, total, progress, hasher)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            except BaseException:
+                tmp_file.close()
+                os.remove(tmp_file.name)
+                raise
+        return tmp_file.name
+
+    def _release_blobs(self, conn, digests):
+        cursor = conn.cursor()
+        counts = Counter(digests)
+        cursor.executemany('UPDATE blobs SET refcount = refcount - ? WHERE hash = ?',
+                           [(count, digest) for digest, count in counts.items()])
+        # Drop the bytes only once the last media row referring to them is gone
+        cursor.execute('''
+            SELECT hash, data_id, path FROM blobs
+            WHERE hash IN (SELECT value FROM json_each(?)) AND refcount <= 0
+        ''', (json.dumps(list(counts)),))
+        dead = cursor.fetchall()
+        cursor.executemany('DELETE FROM blob_data WHERE id = ?', [(data_id,) for _, data_id, _ in dead if data_id is not None])
+        cursor.executemany('DELETE FROM blobs WHERE hash = ?', [(digest,) for digest, _, _ in dead])
+        # Object files are returned so the caller can remove them once the transaction commits
+        return [path for _, _, path in dead if path]
+
+    def _remove_objects(self, paths):
+        # Called once a release has committed, or once the unit that placed a file has rolled back;
+        # content that still has a blobs row (stored again in the same batch or commit group) keeps its file
+        conn = self.db.connection()
+        for path in paths:
+            if conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (os.path.basename(path),)).fetchone():
+                continue
+            try:
+                os.remove(os.path.join(self.object_dir, path))
+            except FileNotFoundError:
+                pass
+
+    def _checkpoint(self):
+        self.db.connection().execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+
+    def _open_payload(self, conn, data_id, path):
+        return _open_payload(conn, self.object_dir, data_id, path)
+
     def get_media_data(self, title):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT data FROM media WHERE title = ?', (title,))
-            row = cursor.fetchone()
-            return row[0] if row else None
-
-    def add_media(self, media_type, title):
-        filetypes = {
-            "pdf": [("PDF files", "*.pdf")],
-            "mp4": [("MP4 files", "*.mp4")],
-            "mp3": [("MP3 files", "*.mp3")]
-        }
-        file_path = filedialog.askopenfilename(filetypes=filetypes[media_type])
+        conn = self.db.connection()
+        cursor = conn.cursor()
+        # The current hash is read on every call, so a change made by another process is never masked
+        row = cursor.execute('SELECT blob_hash FROM media WHERE title = ?', (title,)).fetchone()
+        if not row or not row[0]:
+            return None
+        digest = row[0]
+        data, generation = self.payloads.get(title, digest)
+        if data is not None:
+            return data
+        # Read by hash so the payload cached is the one the entry is tagged with
+        row = cursor.execute('SELECT data_id, path, size FROM blobs WHERE hash = ?', (digest,)).fetchone()
+        if not row:
+            return None
+        with self._open_payload(conn, row[0], row[1]) as payload:
+            data = payload.read()
+        if self.payloads.fits(row[2]):
+            self.payloads.put(title, digest, data, generation)
+        return data
+
+    def add_media(self, media_type, title, progress=None):
+        file_path = filedialog.askopenfilename(filetypes=MEDIA_FILETYPES[media_type])
         if file_path:
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-            with sqlite3.connect(self.db_name) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO media (type, title, data) VALUES (?, ?, ?)
-                ''', (media_type, title, file_data))
-            return f'Media "{title}" added successfully.'
+            return self.import_file(media_type, title, file_path, progress)
         else:
             return 'File not found or no file selected!'
 
-    def open_media(self, title):
-        media_data = self.get_media_data(title)
-        if media_data:
-            mime_type, _ = mimetypes.guess_type(title)
-            extension = mimetypes.guess_extension(mime_type) if mime_type else ''
-            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
-                tmp_file.write(media_data)
-                temp_path = tmp_file.name
+    def import_file(self, media_type, title, file_path, progress=None):
+        total = os.path.getsize(file_path)
+        if self.storage == 'sqlite':
+            # Payloads kept in the database can only be copied inside the write transaction
+            return self._write(self._import_file, media_type, title, file_path, total, progress)
+        conn = self.db.connection()
+        # A cheap pre-check so a taken title is not copied for nothing; the writer checks again
+        if conn.execute('SELECT 1 FROM media WHERE title = ?', (title,)).fetchone():
+            return f'Title "{title}" already exists.'
+        staged = self._stage_import(conn, media_type, file_path, total, progress)
+        try:
+            return self._write(self._import_file, media_type, title, file_path, total, None, staged)
+        finally:
+            self._discard_staged(staged)
+
+    def _import_file(self, conn, media_type, title, file_path, total, progress, staged=None):
+        # The authoritative check, made before anything is stored
+        if conn.execute('SELECT 1 FROM media WHERE title = ?', (title,)).fetchone():
+            return f'Title "{title}" already exists.'
+        digest, fields = self._ingest(conn, media_type, file_path, total, progress, staged=staged)
+        self._insert_media(conn, media_type, title, digest, fields)
+        return f'Media "{title}" added successfully.'
+
+    def import_directory(self, root, batch_size=100, workers=4, progress=None):
+        candidates = []
+        for directory, subdirs, files in os.walk(root):
+            subdirs.sort()
+            for name in sorted(files):
+                stem, extension = os.path.splitext(name)
+                media_type = extension[1:].lower()
+                if media_type in MEDIA_FILETYPES:
+                    path = os.path.join(directory, name)
+                    title = os.path.relpath(os.path.join(directory, stem), root).replace(os.sep, '/')
+                    candidates.append((os.path.abspath(path), media_type, title))
+        result = {'imported': 0, 'skipped': 0, 'failed': {}}
+        conn = self.db.connection()
+        pending = []
+        sources = {}
+        for path, media_type, title in candidates:
+            # Titles drop the extension, so lecture.mp3 and lecture.pdf would share one; the first file keeps it
+            if title in sources:
+                result['failed'][path] = f'Title "{title}" is already taken by {sources[title]}'
+                continue
+            sources[title] = path
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                result['failed'][path] = str(e)
+                continue
+            row = conn.execute('SELECT size, mtime_ns FROM imports WHERE path = ?', (path,)).fetchone()
+            exists = conn.execute('SELECT 1 FROM media WHERE title = ?', (title,)).fetchone()
+            if row == (stat.st_size, stat.st_mtime_ns) or (exists and not row):
+                result['skipped'] += 1
+            else:
+                pending.append((path, media_type, title, stat))
+        if progress:
+            progress(0, len(pending))
+        # Each file is read once, on the pool, where it is staged; the writer only adds the rows.
+        # Commit in batches so an interruption loses at most one batch
+        chunks = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def stage(chunk):
+                return [executor.submit(self._stage_for_import, path, media_type, stat.st_size)
+                        for path, media_type, _, stat in chunk]
+
+            upcoming = stage(chunks[0]) if chunks else []
+            try:
+                for number, chunk in enumerate(chunks, 1):
+                    # The next batch is staged while this one goes through the writer, and no further,
+                    # so staged copies never pile up ahead of it
+                    current, upcoming = upcoming, stage(chunks[number]) if number < len(chunks) else []
+                    batch = self.batch()
+                    try:
+                        for (path, media_type, title, stat), future in zip(chunk, current):
+                            # A failed file is rolled back on its own without losing the rest of the batch
+                            try:
+                                self._write(self._import_logged, path, media_type, title, stat, future.result())
+                                result['imported'] += 1
+                            except (OSError, sqlite3.Error) as e:
+                                result['failed'][path] = str(e)
+                            done += 1
+                            if progress:
+                                progress(done, len(pending))
+                    finally:
+                        batch.commit()
+                        self._discard_stage_results(current)
+            finally:
+                self._discard_stage_results(upcoming)
+        return result
+
+    def _stage_for_import(self, path, media_type, size):
+        # Pool threads end with the import, so the connection each one opens is closed after every file
+        try:
+            return self._stage_import(self.db.connection(), media_type, path, size)
+        finally:
+            self.db.release()
+
+    def _discard_stage_results(self, futures):
+        for future in futures:
+            if not future.cancel() and not future.exception():
+                self._discard_staged(future.result())
+
+    def _import_logged(self, conn, path, media_type, title, stat, staged):
+        # A source that changed since it was last imported replaces the content of its title,
+        # but only when that title was logged from this same source
+        row = conn.execute('''
+            SELECT media.blob_hash FROM media
+            JOIN imports ON imports.title = media.title
+            WHERE media.title = ? AND imports.path = ?
+        ''', (title, path)).fetchone()
+        if not row and conn.execute('SELECT 1 FROM media WHERE title = ?', (title,)).fetchone():
+            raise sqlite3.IntegrityError(f'Title "{title}" already exists.')
+        new_digest, fields = self._ingest(conn, media_type, path, stat.st_size, staged=staged)
+        if row:
+            conn.execute('''
+                UPDATE media SET type = ?, blob_hash = ?, size = ?, mtime = ?, duration = ?, page_count = ?,
+                    mime = ?, extension = ?
+                WHERE title = ?
+            ''', (media_type, new_digest) + fields + (title,))
+            released = self._release_blobs(conn, [row[0]] if row[0] else [])
+            self.db.after_commit(lambda: self._remove_objects(released))
+            self.db.after_commit(lambda: self.payloads.invalidate([title]))
+        else:
+            self._insert_media(conn, media_type, title, new_digest, fields)
+        conn.execute('''
+            INSERT OR REPLACE INTO imports (path, size, mtime_ns, title) VALUES (?, ?, ?, ?)
+        ''', (path, stat.st_size, stat.st_mtime_ns, title))
+
+    def _insert_media(self, conn, media_type, title, digest, fields):
+        conn.execute('''
+            INSERT INTO media (type, title, blob_hash, size, mtime, duration, page_count, mime, extension)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (media_type, title, digest) + fields)
+
+    def _describe_media(self, conn, media_type, file, total, digest):
+        mtime = os.fstat(file.fileno()).st_mtime
+        # Content already described under another title needs no second probe
+        row = conn.execute('''
+            SELECT duration, page_count, mime, extension FROM media WHERE blob_hash = ? AND type = ? LIMIT 1
+        ''', (digest, media_type)).fetchone()
+        if not row:
+            file.seek(0)
+            head = file.read(64)
+            file.seek(0)
+            row = _probe_media(media_type, file, total) + _sniff_format(head, media_type)
+        return (total, mtime) + tuple(row)
+
+    def get_media_info(self, title):
+        conn = self.db.connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT title, type, size, mtime, blob_hash, duration, page_count, mime, extension
+            FROM media WHERE title = ?
+        ''', (title,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return dict(zip(('title', 'type', 'size', 'mtime', 'hash', 'duration', 'page_count', 'mime', 'extension'),
+                        row))
+
+    def export_media(self, title, stream, progress=None):
+        conn = self.db.connection()
+        cursor = conn.cursor()
+        row = _locate_media(cursor, title)
+        if not row:
+            return False
+        # Copy through an incremental handle so only one chunk is held in memory
+        with self._open_payload(conn, row[0], row[1]) as payload:
+            _copy_chunks(payload, stream, row[2], progress)
+        return True
+
+    def read_media(self, title):
+        # Random access without loading the payload: an mmap for object files,
+        # a seekable BlobReader for payloads kept in the database
+        conn = self.db.connection()
+        row = _locate_media(conn.cursor(), title)
+        if not row:
+            return None
+        data_id, path, size = row
+        if path:
+            if size == 0:
+                return io.BytesIO()
+            with open(os.path.join(self.object_dir, path), 'rb') as file:
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return BlobReader(self.db_name, data_id)
+
+    def open_media(self, title, progress=None):
+        # Fail before touching the store when nothing could open the result anyway
+        if not self.opener.available():
+            return 'Could not open media: no program available to open it.'
+        info = self.get_media_info(title)
+        if not info:
+            return 'Media not found.'
+        # With the media server running, players stream straight from the store instead of a temp copy
+        if self.server:
             try:
-                os.startfile(temp_path)
+                self.opener.launch(self.server.url(title))
                 return f'Opening "{title}"...'
             except Exception as e:
                 return f'Could not open media: {e}'
-        else:
+        # Extractions are cached by content hash, so reopening an item reuses the earlier copy;
+        # the extension recorded at ingest lets the opener pick the right program first time
+        try:
+            temp_path = self.cache.extract(info['hash'], info['extension'] or '',
+                                           lambda stream, report: self.export_media(title, stream, report), progress)
+        except FileNotFoundError:
+            # Deleted while it was being opened
             return 'Media not found.'
+        try:
+            self.opener.launch(temp_path)
+            return f'Opening "{title}"...'
+        except Exception as e:
+            return f'Could not open media: {e}'
 
     def delete_media(self, title):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            # First set BLOB data to NULL to ensure it's cleared from the database
-            cursor.execute('UPDATE media SET data = NULL WHERE title = ?', (title,))
-            # Then delete the record
-            cursor.execute('DELETE FROM media WHERE title = ?', (title,))
-            conn.commit()
-            # VACUUM to reclaim storage space
-            cursor.execute('VACUUM')
-            return f'Media "{title}" deleted.'
+        return self.delete_many([title])[title]
+
+    def delete_many(self, titles):
+        titles = list(dict.fromkeys(titles))
+        found = self._write(self._delete_many, titles)
+        # Freed pages are reclaimed in the background by the compaction scheduler
+        if self.compactor:
+            self.compactor.notify()
+        return {title: f'Media "{title}" deleted.' if title in found else f'Media "{title}" not found.'
+                for title in titles}
+
+    def _delete_many(self, conn, titles):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT title, blob_hash FROM media WHERE title IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(titles),))
+        rows = cursor.fetchall()
+        # Release the stored bytes first; they are only dropped when no other title shares them
+        released = self._release_blobs(conn, [digest for _, digest in rows if digest])
+        # Then delete all the records in one pass
+        found = {title for title, _ in rows}
+        cursor.executemany('DELETE FROM media WHERE title = ?', [(title,) for title in found])
+        # A logged source no longer owns its title once the item is gone
+        cursor.executemany('DELETE FROM imports WHERE title = ?', [(title,) for title in found])
+        self.db.after_commit(lambda: self._remove_objects(released))
+        self.db.after_commit(lambda: self.payloads.invalidate(found))
+        return found
+
+    def free_pages(self):
+        return self.db.connection().execute('PRAGMA freelist_count').fetchone()[0]
+
+    def compact(self, max_pages=None, step=COMPACT_STEP, progress=None):
+        total = self.free_pages()
+        if max_pages is not None:
+            total = min(total, max_pages)
+        done = 0
+        while done < total:
+            count = min(step, total - done)
+            # Each step is its own write, so other mutations can run in between
+            self._write(self._vacuum_step, count)
+            done += count
+            if progress:
+                progress(done, total)
+        return f'Reclaimed {done} free pages.'
+
+    def _vacuum_step(self, conn, count):
+        # execute() steps the pragma once, freeing a single page; executescript() would commit the open transaction
+        for _ in range(count):
+            conn.execute('PRAGMA incremental_vacuum(1)')
 
     def rename_media(self, old_title, new_title):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            # Check if old title exists
-            cursor.execute('SELECT COUNT(*) FROM media WHERE title = ?', (old_title,))
-            if cursor.fetchone()[0] == 0:
-                return f'Media "{old_title}" not found.'
-            # Check if new title already exists
-            cursor.execute('SELECT COUNT(*) FROM media WHERE title = ?', (new_title,))
-            if cursor.fetchone()[0] > 0:
-                return f'Title "{new_title}" already exists.'
-            # Perform the rename
+        return self._write(self._rename_media, old_title, new_title)
+
+    def _rename_media(self, conn, old_title, new_title):
+        cursor = conn.cursor()
+        # The unique title index rejects a rename onto an existing title
+        try:
             cursor.execute('UPDATE media SET title = ? WHERE title = ?', (new_title, old_title))
-            conn.commit()
-            return f'Media "{old_title}" renamed to "{new_title}".'
+        except sqlite3.IntegrityError:
+            return f'Title "{new_title}" already exists.'
+        if cursor.rowcount == 0:
+            return f'Media "{old_title}" not found.'
+        cursor.execute('UPDATE imports SET title = ? WHERE title = ?', (new_title, old_title))
+        self.db.after_commit(lambda: self.payloads.invalidate([old_title, new_title]))
+        return f'Media "{old_title}" renamed to "{new_title}".'
 
     
-    def search_media(self, media_type, title):
-            query = 'SELECT title, type FROM media WHERE 1=1'
-            params = []
-            if media_type:
-                query += ' AND type = ?'
-                params.append(media_type)
+    def search_media(self, media_type, title, lazy=False, batch_size=SEARCH_PAGE_SIZE):
+            if lazy:
+                # Streams straight from the database, for listings too large to want in memory twice
+                query, params = _search_query(media_type, title)
+                return self._iter_rows(query, params, batch_size)
+            # Answered from the in-memory catalogue, which only rereads rows changed since the last search
+            return self.catalogue.search(media_type, title)
+
+    def _iter_rows(self, query, params, batch_size):
+        # Rows are pulled from the cursor batch by batch, so memory stays constant however many match.
+        # A half-read listing keeps its read snapshot open, so it gets a private connection and the
+        # thread's other reads still see new changes
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        try:
+            cursor = conn.execute(query, params)
+            while rows := cursor.fetchmany(batch_size):
+                yield from rows
+        finally:
+            conn.close()
+
+    def search_ranked(self, title, media_type=None, limit=None):
+        params = []
+        if len(title) >= 3:
+            # Best bm25 matches first
+            query = '''
+                SELECT media.title, media.type FROM media_fts
+                JOIN media ON media.id = media_fts.rowid
+                WHERE media_fts MATCH ?
+            '''
+            params.append(_fts_phrase(title))
+            order = ' ORDER BY bm25(media_fts), media.title'
+        else:
+            query = 'SELECT media.title, media.type FROM media WHERE 1=1'
             if title:
-                query += ' AND title LIKE ?'
-                params.append('%' + title + '%')
-            with sqlite3.connect(self.db_name) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query, params)
-                return cursor.fetchall()
+                condition, param = _title_filter(title)
+                query += condition
+                params.append(param)
+            order = ' ORDER BY media.title'
+        if media_type:
+            query += ' AND media.type = ?'
+            params.append(media_type)
+        query += order + ' LIMIT ?'
+        params.append(-1 if limit is None else limit)
+        conn = self.db.connection()
+        return conn.execute(query, params).fetchall()
+
+    def search_page(self, media_type, title, after=None, limit=SEARCH_PAGE_SIZE):
+        # Keyset pagination: pass the last title of one page as `after` to get the next.
+        # Pages come from the in-memory catalogue, so scrolling never goes back to the database
+        return self.catalogue.page(media_type, title, after, limit)
 
     def register_user(self, username, password):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
-                conn.commit()
-                return "User registered successfully."
-            except sqlite3.IntegrityError:
-                return "Username already exists."
+        return self._write(self._register_user, username, password)
+
+    def _register_user(self, conn, username, password):
+        try:
+            conn.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
+            return "User registered successfully."
+        except sqlite3.IntegrityError:
+            return "Username already exists."
 
     def login_user(self, username, password):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM users WHERE username = ? AND password = ?', (username, password))
-            return "Login successful." if cursor.fetchone()[0] == 1 else "Invalid username or password."
+        conn = self.db.connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM users WHERE username = ? AND password = ?', (username, password))
+        return "Login successful." if cursor.fetchone()[0] == 1 else "Invalid username or password."
+
+# Per-process state of a ReadService worker
+_reader = None
+
+def _init_reader(db_name, object_dir):
+    global _reader
+    # A read-only connection: a worker can never take the write lock
+    conn = sqlite3.connect('file:' + quote(os.path.abspath(db_name)) + '?mode=ro', uri=True)
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute('PRAGMA cache_size = -16384')
+    conn.execute('PRAGMA mmap_size = 268435456')
+    _reader = (conn, object_dir)
+
+def _read_search(media_type, title):
+    conn, _ = _reader
+    query, params = _search_query(media_type, title)
+    return conn.execute(query, params).fetchall()
+
+def _read_export(title, target):
+    conn, object_dir = _reader
+    row = _locate_media(conn.cursor(), title)
+    if not row:
+        return False
+    # The payload is streamed to target inside the worker; only the result crosses back to the caller
+    with _open_payload(conn, object_dir, row[0], row[1]) as payload, open(target, 'wb') as stream:
+        _copy_chunks(payload, stream, row[2])
+    return True
+
+class ReadService:
+
+    def __init__(self, db_name, object_dir, workers=None):
+        # Spawned rather than forked, so no worker inherits the parent's open connections or threads
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_reader, initargs=(db_name, object_dir))
+
+    def search(self, media_type, title):
+        return self.executor.submit(_read_search, media_type, title)
+
+    def export(self, title, target):
+        return self.executor.submit(_read_export, title, target)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+def _parse_range(header, size):
+    # Returns the inclusive (start, end) of a single 'bytes=' range; ValueError if it cannot be served
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        raise ValueError(header)
+    first, _, last = spec.strip().partition('-')
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    manager = None
+    # Set by MediaServer: the secret first path segment, and the only Host header accepted
+    token = None
+    authority = None
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def finish(self):
+        # Every request runs on a new thread; its database connection goes with it
+        try:
+            super().finish()
+        finally:
+            self.manager.db.release()
+
+    def serve(self, send_body):
+        # Any local process or user can connect, and a page using DNS rebinding can too: only a
+        # request naming this server's address and carrying its token gets through
+        if self.headers.get('Host') != self.authority:
+            self.send_error(403, 'Forbidden')
+            return
+        prefix = '/media/'
+        info = None
+        if self.path.startswith(prefix):
+            token, _, title = self.path[len(prefix):].split('?')[0].partition('/')
+            if hmac.compare_digest(token.encode(), self.token.encode()):
+                info = self.manager.get_media_info(unquote(title))
+        reader = info and self.manager.read_media(info['title'])
+        if not reader:
+            self.send_error(404, 'Media not found')
+            return
+        with reader:
+            size = info['size']
+            start, end = 0, size - 1
+            status = 200
+            if self.headers.get('Range') and size:
+                try:
+                    start, end = _parse_range(self.headers['Range'], size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.end_headers()
+                    return
+                status = 206
+            self.send_response(status)
+            self.send_header('Content-Type', info['mime'] or 'application/octet-stream')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if send_body:
+                reader.seek(start)
+                try:
+                    _copy_chunks(reader, self.wfile, end - start + 1)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Players routinely drop a connection when they seek elsewhere
+                    pass
+
+    def log_message(self, format, *args):
+        pass
+
+class MediaServer:
+
+    def __init__(self, manager, host='127.0.0.1', port=0):
+        self.token = secrets.token_urlsafe(32)
+        handler = type('BoundMediaRequestHandler', (MediaRequestHandler,), {'manager': manager, 'token': self.token})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self.authority = f'[{self.host}]:{self.port}' if ':' in self.host else f'{self.host}:{self.port}'
+        handler.authority = self.authority
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='media-server', daemon=True)
+        self.thread.start()
+
+    def url(self, title):
+        return f'http://{self.authority}/media/{self.token}/{quote(title, safe="")}'
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class MediaFuture(Future):
+
+    def __init__(self):
+        super().__init__()
+        self.cancel_requested = threading.Event()
+
+    def cancel(self):
+        # A task that is already running stops at its next progress report
+        self.cancel_requested.set()
+        return super().cancel()
+
+class AsyncMediaManager:
+
+    def __init__(self, manager, root, workers=2, poll_interval=50):
+        self.manager = manager
+        self.root = root
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-worker')
+        # Worker threads never touch Tk; they queue callbacks that poll() runs on the Tk thread
+        self.callbacks = queue.Queue()
+        self.active = set()
+        self.poll_id = root.after(poll_interval, self.poll)
+
+    def submit(self, func, *args, on_done=None, on_progress=None, **kwargs):
+        future = MediaFuture()
+        if 'progress' in inspect.signature(func).parameters:
+            def progress(done, total):
+                if future.cancel_requested.is_set():
+                    raise OperationCancelled()
+                if on_progress:
+                    self.callbacks.put((on_progress, (done, total)))
+            kwargs['progress'] = progress
+        self.active.add(future)
+        future.add_done_callback(lambda done: self.callbacks.put((self._finish, (done, on_done))))
+        self.executor.submit(self._run, future, func, args, kwargs)
+        return future
+
+    def _run(self, future, func, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _finish(self, future, on_done):
+        self.active.discard(future)
+        if on_done:
+            on_done(future)
+
+    def poll(self):
+        self.poll_id = self.root.after(self.poll_interval, self.poll)
+        while True:
+            try:
+                callback, args = self.callbacks.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+
+    def cancel_all(self):
+        for future in list(self.active):
+            future.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        self.executor.shutdown(wait=True)
+        try:
+            self.root.after_cancel(self.poll_id)
+        except tk.TclError:
+            pass
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+class IngestQueue:
+
+    def __init__(self, parent, manager):
+        self.manager = manager
+        self.frame = tk.LabelFrame(parent, text="匯入佇列", font=("Helvetica", 12))
+        # In-database payloads are copied inside the write transaction, so those ingests run one after
+        # another; object files are copied before the writer is involved, so two copies can overlap
+        workers = 1 if manager.storage == 'sqlite' else 2
+        self.tasks = AsyncMediaManager(manager, parent, workers=workers)
+
+    def add(self, media_type, title, file_path, on_done=None):
+        row = tk.Frame(self.frame)
+        row.pack(fill="x", padx=5, pady=2)
+        tk.Label(row, text=title, width=20, anchor="w").pack(side="left")
+        bar = ttk.Progressbar(row, length=240, maximum=max(os.path.getsize(file_path), 1))
+        bar.pack(side="left", padx=5)
+        rate_label = tk.Label(row, text="等待中", width=24, anchor="w")
+        rate_label.pack(side="left")
+        started = []
+
+        def report(done, total):
+            now = time.monotonic()
+            # Rate is measured from the first report, so time spent waiting in the queue is not counted
+            if not started:
+                started.extend((now, done))
+            bar.config(value=done)
+            elapsed = now - started[0]
+            if elapsed > 0:
+                rate = (done - started[1]) / elapsed
+                eta = (total - done) / rate if rate else 0
+                rate_label.config(text=f"{_format_size(rate)}/s，剩餘 {eta:.0f} 秒")
+
+        def finished(future):
+            if future.cancelled() or isinstance(future.exception(), OperationCancelled):
+                rate_label.config(text="已取消")
+            elif future.exception():
+                rate_label.config(text=f"失敗: {future.exception()}")
+            else:
+                bar.config(value=bar["maximum"])
+                rate_label.config(text=future.result())
+            row.after(5000, row.destroy)
+            if on_done:
+                on_done(future)
+
+        future = self.tasks.submit(self.manager.import_file, media_type, title, file_path,
+                                   on_done=finished, on_progress=report)
+        tk.Button(row, text="取消", command=future.cancel).pack(side="left")
+        return future
+
+    def shutdown(self):
+        self.tasks.shutdown()
 
 class MediaManagerApp:
     
-    def __init__(self, root):
-        self.manager = MediaManager()
+    def __init__(self, root, manager=None):
+        self.manager = manager or MediaManager()
         self.root = root
         self.root.title("媒體管理器")
         self.root.geometry("800x600")
@@ -147,9 +1989,16 @@ class MediaManagerApp:
         tk.Label(root, text="媒體管理器", font=("Helvetica", 24)).pack(pady=20)
         self.status_label = tk.Label(root, text="", font=("Helvetica", 12))
         self.status_label.pack(pady=10)
+        # Storage work runs on worker threads so the window stays responsive
+        self.tasks = AsyncMediaManager(self.manager, root)
+        tk.Button(root, text="取消", command=self.tasks.cancel_all, font=("Helvetica", 12)).pack()
 
         tk.Button(root, text="新增媒體", command=self.add_media_gui, **button_options).pack(pady=10)
         tk.Button(root, text="管理媒體", command=self.manage_media_gui, **button_options).pack(pady=10)
+        tk.Button(root, text="壓縮資料庫", command=self.compact_gui, **button_options).pack(pady=10)
+
+        self.ingest = IngestQueue(root, self.manager)
+        self.ingest.frame.pack(fill="both", expand=True, padx=10, pady=10)
 
     def center_window(self, window):
         window.update_idletasks()
@@ -159,6 +2008,27 @@ class MediaManagerApp:
         y = (window.winfo_screenheight() // 2) - (height // 2)
         window.geometry(f'{width}x{height}+{x}+{y}')
 
+    def run_task(self, label, func, *args, on_done=None):
+        def report(done, total):
+            percent = done * 100 // total if total else 100
+            self.status_label.config(text=f"{label} {percent}%")
+
+        def finished(future):
+            if future.cancelled() or isinstance(future.exception(), OperationCancelled):
+                self.status_label.config(text=f"{label}已取消。")
+            elif future.exception():
+                self.status_label.config(text=f"{label}失敗: {future.exception()}")
+            elif on_done:
+                on_done(future.result())
+            else:
+                self.status_label.config(text=future.result())
+
+        self.status_label.config(text=f"{label}...")
+        return self.tasks.submit(func, *args, on_done=finished, on_progress=report)
+
+    def compact_gui(self):
+        self.run_task("壓縮中", self.manager.compact)
+
     def add_media_gui(self):
         add_window = tk.Toplevel(self.root)
         add_window.title("新增媒體")
@@ -178,9 +2048,13 @@ class MediaManagerApp:
         def add_media_action():
             media_type = media_type_combobox.get()
             title = title_entry.get()
-            result = self.manager.add_media(media_type, title)
-            self.status_label.config(text=result)
+            file_path = filedialog.askopenfilename(filetypes=MEDIA_FILETYPES[media_type])
             add_window.destroy()
+            if file_path:
+                self.ingest.add(media_type, title, file_path)
+                self.status_label.config(text=f"「{title}」已加入匯入佇列。")
+            else:
+                self.status_label.config(text='File not found or no file selected!')
 
         tk.Button(add_window, text="新增", command=add_media_action, font=font_large).pack(pady=20)
         tk.Button(add_window, text="返回上一頁", command=add_window.destroy, font=font_large).pack(pady=10)
@@ -205,37 +2079,61 @@ class MediaManagerApp:
         tk.Button(title_frame, text="搜尋", command=lambda: search_media_action(), font=font_large).pack(side="left", padx=5)
 
         columns = ("title", "type")
-        tree = ttk.Treeview(manage_window, columns=columns, show="headings", height=13)
+        tree = ttk.Treeview(manage_window, columns=columns, show="headings", height=13, selectmode="extended")
         tree.heading("title", text="標題")
         tree.heading("type", text="檔案類型")
         tree.pack(pady=10, fill="both", expand=True)
         
         scrollbar_y = Scrollbar(manage_window, orient="vertical", command=tree.yview)
         scrollbar_y.pack(side="right", fill="y")
-        tree.configure(yscrollcommand=scrollbar_y.set)
+
+        # Results are fetched a page at a time as the list is scrolled towards its end
+        page = {"media_type": "", "title": "", "after": None, "done": True, "pending": False}
+
+        def load_next_page():
+            page["pending"] = False
+            if page["done"]:
+                return
+            results = self.manager.search_page(page["media_type"], page["title"], page["after"])
+            for title, media_type in results:
+                tree.insert("", "end", values=(title, media_type))
+            if results:
+                page["after"] = results[-1][0]
+            page["done"] = len(results) < SEARCH_PAGE_SIZE
+
+        def on_tree_scroll(first, last):
+            scrollbar_y.set(first, last)
+            if float(last) > 0.9 and not page["done"] and not page["pending"]:
+                page["pending"] = True
+                tree.after_idle(load_next_page)
+
+        tree.configure(yscrollcommand=on_tree_scroll)
 
         def search_media_action():
-            media_type = media_type_combobox.get()
-            title = title_entry.get()
-            results = self.manager.search_media(media_type, title)
+            page.update(media_type=media_type_combobox.get(), title=title_entry.get(), after=None, done=False)
             tree.delete(*tree.get_children())
-            for result in results:
-                title, media_type = result[:2]
-                tree.insert("", "end", values=(title, media_type))
+            load_next_page()
 
         def delete_media_action():
-            selected_item = tree.selection()
-            if selected_item:
-                title = tree.item(selected_item, "values")[0]
-                self.manager.delete_media(title)
-                tree.delete(selected_item)
+            selected_items = tree.selection()
+            if selected_items:
+                titles = [tree.item(item, "values")[0] for item in selected_items]
+
+                def deleted(results):
+                    if tree.winfo_exists():
+                        tree.delete(*[item for item in selected_items if tree.exists(item)])
+                    if len(titles) == 1:
+                        self.status_label.config(text=results[titles[0]])
+                    else:
+                        self.status_label.config(text=f"已刪除 {len(titles)} 個媒體。")
+
+                self.run_task("刪除中", self.manager.delete_many, titles, on_done=deleted)
 
         def open_media_action():
             selected_item = tree.selection()
             if selected_item:
                 title = tree.item(selected_item, "values")[0]
-                result = self.manager.open_media(title)
-                self.status_label.config(text=result)
+                self.run_task("打開中", self.manager.open_media, title)
 
         def rename_media_action():
             selected_item = tree.selection()
@@ -243,9 +2141,12 @@ class MediaManagerApp:
                 old_title = tree.item(selected_item, "values")[0]
                 new_title = simpledialog.askstring("重新命名標題", "輸入新的標題:")
                 if new_title:
-                    result = self.manager.rename_media(old_title, new_title)
-                    self.status_label.config(text=result)
-                    search_media_action()  # Refresh the display after renaming
+                    def renamed(result):
+                        self.status_label.config(text=result)
+                        if tree.winfo_exists():
+                            search_media_action()  # Refresh the display after renaming
+
+                    self.run_task("重新命名中", self.manager.rename_media, old_title, new_title, on_done=renamed)
                     
 
         button_frame = tk.Frame(manage_window)
@@ -313,12 +2214,56 @@ class AuthWindow:
     def open_main_app(self):
         self.root.destroy()
         new_root = tk.Tk()
-        app = MediaManagerApp(new_root)
+        app = MediaManagerApp(new_root, self.manager)
         new_root.mainloop()
+        app.ingest.shutdown()
+        app.tasks.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="媒體管理器")
+    parser.add_argument("--db", default="media_manager.db", help="database file")
+    parser.add_argument("--storage", choices=["sqlite", "file"], default="sqlite", help="where new payloads are kept")
+    parser.add_argument("--serve", action="store_true", help="stream opened media to players over a localhost HTTP server")
+    commands = parser.add_subparsers(dest="command")
+    import_parser = commands.add_parser("import", help="import every pdf/mp4/mp3 file under a directory")
+    import_parser.add_argument("directory")
+    import_parser.add_argument("--batch-size", type=int, default=100, help="files per commit")
+    import_parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="hashing threads")
+    list_parser = commands.add_parser("list", help="print matching titles and types, one per line")
+    list_parser.add_argument("--type", default="", choices=["", "pdf", "mp4", "mp3"])
+    list_parser.add_argument("--title", default="", help="title substring to match")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        manager = MediaManager(args.db, args.storage, auto_compact=False)
+        try:
+            for title, media_type in manager.search_media(args.type, args.title, lazy=True):
+                print(f"{title}\t{media_type}")
+        finally:
+            manager.close()
+        return
+
+    if args.command == "import":
+        manager = MediaManager(args.db, args.storage, auto_compact=False)
+        try:
+            result = manager.import_directory(
+                args.directory, args.batch_size, args.workers,
+                progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True))
+        finally:
+            manager.close()
+        print(f"\nImported {result['imported']}, skipped {result['skipped']}, failed {len(result['failed'])}.")
+        for path, error in result["failed"].items():
+            print(f"  {path}: {error}")
+        return
 
-if __name__ == "__main__":
     root = tk.Tk()
-    manager = MediaManager()
+    manager = MediaManager(args.db, args.storage)
+    if args.serve:
+        manager.start_media_server()
     AuthWindow(root, manager)
     root.mainloop()
+    manager.close()
+
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_manager import MediaManager
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    managers = []
+
+    def make(name='media_manager.db', **kwargs):
+        kwargs.setdefault('auto_compact', False)
+        kwargs.setdefault('cache_dir', str(tmp_path / 'cache'))
+        manager = MediaManager(str(tmp_path / name), **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.close()
+
+
+@pytest.fixture
+def write_file(tmp_path):
+    def write(name, data):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return str(path)
+
+    return write
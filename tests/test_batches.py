@@ -0,0 +1,132 @@
+import os
+import sqlite3
+
+import pytest
+
+
+@pytest.mark.parametrize('mode', ['batch', 'group commit'])
+def test_released_content_stored_again_keeps_its_file(make_manager, write_file, mode):
+    path = write_file('notes.pdf', b'%PDF-1.4\nshared')
+    manager = make_manager(storage='file')
+    manager.import_file('pdf', 'A', path)
+
+    if mode == 'batch':
+        with manager.batch():
+            manager.delete_media('A')
+            manager.import_file('pdf', 'B', path)
+    else:
+        manager.start_group_commit(interval=10, max_ops=100)
+        manager.delete_media('A')
+        manager.import_file('pdf', 'B', path)
+        manager.flush()
+
+    assert manager.get_media_data('A') is None
+    assert manager.get_media_data('B') == b'%PDF-1.4\nshared'
+
+
+def test_rolled_back_batch_changes_nothing(make_manager, write_file):
+    manager = make_manager(storage='file')
+    manager.import_file('pdf', 'A', write_file('a.pdf', b'%PDF-1.4\na'))
+
+    with pytest.raises(RuntimeError):
+        with manager.batch():
+            manager.delete_media('A')
+            manager.register_user('alice', 'secret')
+            raise RuntimeError
+
+    assert manager.get_media_data('A') == b'%PDF-1.4\na'
+    assert manager.login_user('alice', 'secret') == 'Invalid username or password.'
+
+
+def test_deleted_object_file_is_removed_after_commit(make_manager, write_file):
+    manager = make_manager(storage='file')
+    manager.import_file('pdf', 'A', write_file('a.pdf', b'%PDF-1.4\na'))
+
+    with manager.batch():
+        manager.delete_media('A')
+
+    objects = [name for _, _, names in os.walk(manager.object_dir) for name in names]
+    assert objects == []
+
+
+def test_batch_raises_when_the_write_lock_cannot_be_taken(make_manager, monkeypatch, tmp_path):
+    manager = make_manager()
+    monkeypatch.setattr('media_manager.WRITE_RETRIES', 2)
+    monkeypatch.setattr('media_manager.WRITE_BACKOFF', 0.01)
+    manager.writer.call(lambda: manager.db.connection().execute('PRAGMA busy_timeout = 50'))
+    rival = sqlite3.connect(str(tmp_path / 'media_manager.db'))
+    rival.execute('BEGIN IMMEDIATE')
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            with manager.batch():
+                manager.register_user('alice', 'secret')
+    finally:
+        rival.rollback()
+        rival.close()
+
+    with manager.batch():
+        manager.register_user('alice', 'secret')
+    assert manager.login_user('alice', 'secret') == 'Login successful.'
+
+
+@pytest.mark.parametrize('call', ['flush', 'start_group_commit'])
+def test_flush_inside_a_batch_leaves_the_batch_open(make_manager, call):
+    manager = make_manager()
+
+    with manager.batch():
+        manager.register_user('alice', 'secret')
+        getattr(manager, call)()
+        manager.register_user('bob', 'secret')
+
+    manager.flush()
+    assert manager.login_user('bob', 'secret') == 'Login successful.'
+
+
+def test_group_commit_returns_once_the_change_is_committed(make_manager, write_file):
+    manager = make_manager()
+    manager.start_group_commit(interval=10, max_ops=100)
+
+    assert manager.register_user('bob', 'secret') == 'User registered successfully.'
+    assert manager.login_user('bob', 'secret') == 'Login successful.'
+    manager.import_file('pdf', 'A', write_file('a.pdf', b'%PDF-1.4\na'))
+    assert manager.get_media_info('A')['title'] == 'A'
+    assert manager.search_media(None, 'A') == [('A', 'pdf')]
+
+
+def test_failed_group_commit_fails_its_mutations(make_manager, monkeypatch):
+    manager = make_manager()
+    manager.start_group_commit(interval=10, max_ops=100)
+    commit = manager.db.commit
+
+    def failing_commit():
+        if manager.db.local.depth == 1:
+            manager.db.local.depth = 0
+            manager.db.local.conn.rollback()
+            raise sqlite3.OperationalError('disk I/O error')
+        commit()
+
+    monkeypatch.setattr(manager.db, 'commit', failing_commit)
+    with pytest.raises(sqlite3.OperationalError):
+        manager.register_user('bob', 'secret')
+    monkeypatch.undo()
+
+    assert manager.login_user('bob', 'secret') == 'Invalid username or password.'
+
+
+def _object_files(manager):
+    return [name for _, _, names in os.walk(manager.object_dir) for name in names]
+
+
+def test_rolled_back_import_leaves_no_object_file(make_manager, write_file):
+    manager = make_manager(storage='file')
+    manager.import_file('pdf', 'A', write_file('a.pdf', b'%PDF-1.4\na'))
+
+    with pytest.raises(RuntimeError):
+        with manager.batch():
+            manager.import_file('pdf', 'B', write_file('b.pdf', b'%PDF-1.4\nb'))
+            manager.import_file('pdf', 'C', write_file('c.pdf', b'%PDF-1.4\na'))
+            raise RuntimeError
+
+    assert len(_object_files(manager)) == 1
+    assert manager.get_media_data('A') == b'%PDF-1.4\na'
+
@@ -0,0 +1,102 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from media_manager import CHUNK_SIZE, MediaManager
+
+
+def _rival_writer(db_name, count):
+    # A second process with its own writer thread, competing for the same write lock
+    manager = MediaManager(db_name, auto_compact=False)
+    for i in range(count):
+        manager.register_user(f'rival {i}', 'secret')
+    manager.close()
+
+
+def test_readers_and_writers_share_one_database(make_manager, write_file, tmp_path):
+    manager = make_manager()
+    path = write_file('notes.pdf', b'%PDF-1.4\nshared')
+    for i in range(50):
+        manager.import_file('pdf', f'title {i}', path)
+    rival = multiprocessing.Process(target=_rival_writer, args=(str(tmp_path / 'media_manager.db'), 100))
+    stop = threading.Event()
+    errors = []
+
+    def read(index):
+        while not stop.is_set():
+            try:
+                manager.search_page(None, 'title', limit=20)
+                manager.get_media_info(f'title {index}')
+                manager.get_media_data(f'title {index}')
+            except Exception as e:
+                errors.append(e)
+
+    def write():
+        for i in range(50):
+            try:
+                manager.rename_media(f'title {i}', f'renamed {i}')
+                manager.register_user(f'writer {i}', 'secret')
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=read, args=(i,)) for i in range(8)]
+    writer = threading.Thread(target=write)
+    rival.start()
+    for thread in readers + [writer]:
+        thread.start()
+    writer.join()
+    rival.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert rival.exitcode == 0
+    conn = manager.db.connection()
+    assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 150
+    assert len(manager.search_media(None, 'renamed')) == 50
+    assert manager.get_media_data('renamed 0') == b'%PDF-1.4\nshared'
+
+
+def test_object_copy_does_not_hold_the_write_lock(make_manager, write_file):
+    manager = make_manager(storage='file')
+    manager.import_file('pdf', 'A', write_file('a.pdf', b'%PDF-1.4\na'))
+    path = write_file('large.pdf', b'%PDF-1.4\n' + bytes(3 * CHUNK_SIZE))
+    copying = threading.Event()
+    resume = threading.Event()
+    results = []
+
+    def progress(done, total):
+        copying.set()
+        assert resume.wait(10)
+
+    importer = threading.Thread(target=lambda: results.append(manager.import_file('pdf', 'B', path, progress)))
+    importer.start()
+    try:
+        assert copying.wait(10)
+        renamer = threading.Thread(target=lambda: results.append(manager.rename_media('A', 'C')))
+        renamer.start()
+        renamer.join(5)
+        assert not renamer.is_alive()
+    finally:
+        resume.set()
+        importer.join()
+
+    assert manager.get_media_data('C') == b'%PDF-1.4\na'
+    assert manager.get_media_data('B') == b'%PDF-1.4\n' + bytes(3 * CHUNK_SIZE)
+    assert len(results) == 2
+
+
+@pytest.mark.parametrize('storage', ['sqlite', 'file'])
+def test_import_directory_stores_every_file(make_manager, tmp_path, storage):
+    for i in range(7):
+        (tmp_path / 'library').mkdir(exist_ok=True)
+        (tmp_path / 'library' / f'doc {i}.pdf').write_bytes(b'%PDF-1.4\n' + bytes([i % 3]))
+    manager = make_manager(storage=storage)
+
+    result = manager.import_directory(str(tmp_path / 'library'), batch_size=3)
+
+    assert (result['imported'], result['failed']) == (7, {})
+    for i in range(7):
+        assert manager.get_media_data(f'doc {i}') == b'%PDF-1.4\n' + bytes([i % 3])
@@ -0,0 +1,64 @@
+import os
+import time
+
+import pytest
+
+from media_manager import CommandOpener, ExtractionCache, STALE_PART_SECONDS
+
+
+def test_default_cache_is_private_and_next_to_the_database(tmp_path, make_manager):
+    manager = make_manager('library.db', cache_dir=None)
+
+    assert manager.cache.directory == str(tmp_path / 'library_cache')
+    assert os.stat(manager.cache.directory).st_mode & 0o077 == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX permissions')
+def test_cache_directory_writable_by_others_is_refused(tmp_path):
+    directory = tmp_path / 'shared'
+    directory.mkdir()
+    directory.chmod(0o777)
+
+    with pytest.raises(PermissionError):
+        ExtractionCache(str(directory))
+
+
+def test_cleanup_keeps_parts_another_instance_is_writing(tmp_path):
+    directory = tmp_path / 'cache'
+    directory.mkdir(mode=0o700)
+    fresh = directory / 'fresh.part'
+    stale = directory / 'stale.part'
+    fresh.write_bytes(b'x')
+    stale.write_bytes(b'x')
+    old = time.time() - STALE_PART_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    ExtractionCache(str(directory))
+
+    assert fresh.exists()
+    assert not stale.exists()
+
+
+def test_content_gone_mid_extract_is_not_cached(tmp_path):
+    cache = ExtractionCache(str(tmp_path / 'cache'))
+
+    with pytest.raises(FileNotFoundError):
+        cache.extract('abc', '.pdf', lambda stream, report: False)
+
+    assert os.listdir(cache.directory) == []
+    assert cache.extract('abc', '.pdf', lambda stream, report: stream.write(b'data') and True).endswith('abc.pdf')
+
+
+def test_open_media_deleted_while_opening(make_manager, write_file):
+    manager = make_manager(opener=CommandOpener('true'))
+    manager.import_file('pdf', 'notes', write_file('notes.pdf', b'%PDF-1.4\n'))
+    export_media = manager.export_media
+
+    def deleted_first(title, stream, progress=None):
+        manager.delete_media(title)
+        return export_media(title, stream, progress)
+
+    manager.export_media = deleted_first
+
+    assert manager.open_media('notes') == 'Media not found.'
+    assert os.listdir(manager.cache.directory) == []
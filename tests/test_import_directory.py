@@ -0,0 +1,74 @@
+import os
+from collections import Counter
+
+import pytest
+
+from media_manager import OperationCancelled
+
+
+def test_titles_colliding_across_extensions_are_reported(tmp_path, make_manager, write_file):
+    mp3 = write_file('library/lecture.mp3', b'ID3' + bytes(50))
+    pdf = write_file('library/lecture.pdf', b'%PDF-1.4\n')
+    manager = make_manager()
+
+    result = manager.import_directory(str(tmp_path / 'library'))
+
+    assert result['imported'] == 1
+    assert list(result['failed']) == [pdf]
+    assert manager.search_media(None, '') == [('lecture', 'mp3')]
+    assert manager.get_media_data('lecture') == b'ID3' + bytes(50)
+    imports = manager.db.connection().execute('SELECT path FROM imports').fetchall()
+    assert imports == [(mp3,)]
+
+
+def test_changed_source_replaces_only_its_own_title(tmp_path, make_manager, write_file):
+    write_file('library/notes.pdf', b'%PDF-1.4\nfirst')
+    manager = make_manager()
+    assert manager.import_directory(str(tmp_path / 'library'))['imported'] == 1
+
+    write_file('library/notes.pdf', b'%PDF-1.4\nsecond version')
+    result = manager.import_directory(str(tmp_path / 'library'))
+
+    assert (result['imported'], result['failed']) == (1, {})
+    assert manager.get_media_data('notes') == b'%PDF-1.4\nsecond version'
+
+    # A title that now belongs to something else is left alone
+    manager.delete_media('notes')
+    manager.import_file('pdf', 'notes', write_file('other.pdf', b'%PDF-1.4\nother'))
+    write_file('library/notes.pdf', b'%PDF-1.4\nthird version')
+    result = manager.import_directory(str(tmp_path / 'library'))
+
+    assert (result['imported'], result['skipped'], result['failed']) == (0, 1, {})
+    assert manager.get_media_data('notes') == b'%PDF-1.4\nother'
+
+
+def test_object_storage_reads_each_new_file_once(tmp_path, make_manager, write_file, monkeypatch):
+    paths = [write_file(f'library/doc {i}.pdf', b'%PDF-1.4\n' + bytes([i])) for i in range(5)]
+    manager = make_manager(storage='file')
+    opened = Counter()
+
+    def counting_open(file, *args, **kwargs):
+        opened[str(file)] += 1
+        return open(file, *args, **kwargs)
+
+    monkeypatch.setattr('media_manager.open', counting_open, raising=False)
+    result = manager.import_directory(str(tmp_path / 'library'), batch_size=2)
+
+    assert (result['imported'], result['failed']) == (5, {})
+    assert [opened[path] for path in paths] == [1] * 5
+
+
+def test_cancelled_import_leaves_no_staged_copies(tmp_path, make_manager, write_file):
+    for i in range(6):
+        write_file(f'library/doc {i}.pdf', b'%PDF-1.4\n' + bytes([i]))
+    manager = make_manager(storage='file')
+
+    def progress(done, total):
+        if done == 3:
+            raise OperationCancelled()
+
+    with pytest.raises(OperationCancelled):
+        manager.import_directory(str(tmp_path / 'library'), batch_size=2, progress=progress)
+
+    assert os.listdir(os.path.join(manager.object_dir, 'tmp')) == []
+    assert len(manager.search_media(None, 'doc')) == 3
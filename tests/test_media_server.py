@@ -0,0 +1,43 @@
+import time
+import urllib.error
+import urllib.request
+
+
+def test_range_requests_do_not_leak_connections(make_manager, write_file):
+    data = bytes(range(256)) * 40
+    manager = make_manager()
+    manager.import_file('mp4', 'clip', write_file('clip.mp4', data))
+    server = manager.start_media_server()
+    baseline = len(manager.db.connections)
+
+    for start in range(0, 3000, 30):
+        request = urllib.request.Request(server.url('clip'), headers={'Range': f'bytes={start}-{start + 99}'})
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 206
+            assert response.read() == data[start:start + 100]
+
+    # Handler threads close their connection just after the response is sent
+    deadline = time.monotonic() + 5
+    while len(manager.db.connections) > baseline and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(manager.db.connections) <= baseline
+
+
+def _status(url, **headers):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_requests_need_the_token_and_the_bound_address(make_manager, write_file):
+    manager = make_manager()
+    manager.import_file('mp4', 'clip', write_file('clip.mp4', bytes(100)))
+    server = manager.start_media_server()
+    url = server.url('clip')
+
+    assert _status(url) == 200
+    assert _status(f'http://{server.host}:{server.port}/media/clip') == 404
+    assert _status(url.replace(server.token, 'x' * len(server.token))) == 404
+    assert _status(url, Host=f'attacker.example:{server.port}') == 403
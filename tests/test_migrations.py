@@ -0,0 +1,73 @@
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from media_manager import MediaManager
+
+
+def build_original_schema(path, rows):
+    # The schema as the first release created it: payloads inline in media.data
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE media (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, title TEXT, data BLOB)')
+        conn.execute('''
+            CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL
+            )
+        ''')
+        conn.executemany('INSERT INTO media (type, title, data) VALUES (?, ?, ?)', rows)
+        conn.execute("INSERT INTO users (username, password) VALUES ('alice', 'secret')")
+    conn.close()
+
+
+@pytest.mark.parametrize('storage', ['sqlite', 'file'])
+def test_upgrade_from_original_schema(tmp_path, make_manager, storage):
+    pdf = b'%PDF-1.4\n/Type /Page\n/Type /Page\n'
+    mp3 = b'ID3' + bytes(100)
+    build_original_schema(tmp_path / 'old.db', [
+        ('pdf', 'notes', pdf),
+        ('pdf', 'notes', pdf),
+        ('mp3', 'song', mp3),
+        ('mp4', 'empty', b''),
+    ])
+
+    manager = make_manager('old.db', storage=storage)
+
+    assert sorted(manager.search_media(None, '')) == [
+        ('empty', 'mp4'), ('notes', 'pdf'), ('notes (2)', 'pdf'), ('song', 'mp3')]
+    assert manager.get_media_data('notes') == pdf
+    assert manager.get_media_data('notes (2)') == pdf
+    assert manager.get_media_data('song') == mp3
+    assert manager.get_media_data('empty') == b''
+    info = manager.get_media_info('song')
+    assert (info['size'], info['mime'], info['extension']) == (len(mp3), 'audio/mpeg', '.mp3')
+    assert manager.get_media_info('notes')['page_count'] == 2
+    assert manager.login_user('alice', 'secret') == 'Login successful.'
+    conn = manager.db.connection()
+    # Identical payloads were folded into one refcounted blob
+    assert conn.execute('SELECT COUNT(*), SUM(refcount) FROM blobs').fetchone() == (3, 4)
+
+
+def _open_and_close(db_name, start):
+    start.wait()
+    MediaManager(db_name, auto_compact=False, cache_dir=db_name + '_cache').close()
+
+
+@pytest.mark.parametrize('trial', range(5))
+def test_instances_opening_a_new_database_together_migrate_it_once(tmp_path, trial):
+    db_name = str(tmp_path / 'media_manager.db')
+    start = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=_open_and_close, args=(db_name, start)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    start.set()
+    for process in processes:
+        process.join()
+
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    with sqlite3.connect(db_name) as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        assert conn.execute('PRAGMA user_version').fetchone()[0] > 0
+    conn.close()
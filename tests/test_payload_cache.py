@@ -0,0 +1,25 @@
+def test_cached_payload_follows_changes_from_another_process(make_manager, write_file):
+    first = make_manager()
+    second = make_manager()
+    first.import_file('pdf', 'A', write_file('a.pdf', b'%PDF-1.4\na'))
+    first.import_file('pdf', 'B', write_file('b.pdf', b'%PDF-1.4\nb'))
+    assert second.get_media_data('A') == b'%PDF-1.4\na'
+    assert second.get_media_data('B') == b'%PDF-1.4\nb'
+
+    first.delete_media('A')
+    first.delete_media('B')
+    first.import_file('pdf', 'B', write_file('c.pdf', b'%PDF-1.4\nc'))
+
+    assert second.get_media_data('A') is None
+    assert second.get_media_data('B') == b'%PDF-1.4\nc'
+
+
+def test_repeated_reads_are_served_from_the_cache(make_manager, write_file):
+    manager = make_manager()
+    manager.import_file('pdf', 'A', write_file('a.pdf', b'%PDF-1.4\na'))
+
+    for _ in range(3):
+        assert manager.get_media_data('A') == b'%PDF-1.4\na'
+
+    stats = manager.payloads.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 1, 1)
@@ -0,0 +1,39 @@
+import struct
+
+import pytest
+
+from media_manager import _probe_media
+
+
+def mp4(mvhd_body):
+    mvhd = struct.pack('>I4s', 8 + len(mvhd_body), b'mvhd') + mvhd_body
+    moov = struct.pack('>I4s', 8 + len(mvhd), b'moov') + mvhd
+    return struct.pack('>I4s4s', 16, b'ftyp', b'isom') + bytes(4) + moov
+
+
+@pytest.mark.parametrize('body', [b'', b'\x00', b'\x01' + bytes(10), bytes(19)])
+def test_truncated_mp4_header_is_only_missing_metadata(tmp_path, body):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(mp4(body))
+    with open(path, 'rb') as file:
+        assert _probe_media('mp4', file, path.stat().st_size) == (None, None)
+
+
+def test_mp4_duration(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(mp4(bytes(12) + struct.pack('>II', 1000, 90500) + bytes(80)))
+    with open(path, 'rb') as file:
+        assert _probe_media('mp4', file, path.stat().st_size) == (90.5, None)
+
+
+def test_truncated_mp4_still_imports(tmp_path, make_manager, write_file):
+    data = mp4(b'\x01')
+    write_file('library/clip.mp4', data)
+    manager = make_manager()
+
+    assert manager.import_file('mp4', 'single', str(tmp_path / 'library/clip.mp4')) == 'Media "single" added successfully.'
+    result = manager.import_directory(str(tmp_path / 'library'))
+
+    assert (result['imported'], result['failed']) == (1, {})
+    assert manager.get_media_data('clip') == data
+    assert manager.get_media_info('clip')['duration'] is None
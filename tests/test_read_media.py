@@ -0,0 +1,85 @@
+import io
+import mmap
+
+import pytest
+
+from media_manager import CHUNK_SIZE, BlobReader
+
+
+DATA = bytes(range(256)) * (CHUNK_SIZE // 128 + 3)
+
+
+@pytest.fixture(params=['sqlite', 'file'])
+def stored(request, make_manager, write_file):
+    manager = make_manager(storage=request.param)
+    manager.import_file('mp4', 'clip', write_file('clip.mp4', DATA))
+    manager.import_file('mp4', 'empty', write_file('empty.mp4', b''))
+    return manager
+
+
+def test_random_access_reads(stored):
+    with stored.read_media('clip') as reader:
+        for offset in (0, 1, 255, CHUNK_SIZE - 1, CHUNK_SIZE, len(DATA) - 10):
+            reader.seek(offset)
+            assert reader.tell() == offset
+            assert reader.read(100) == DATA[offset:offset + 100]
+            assert reader.tell() == min(offset + 100, len(DATA))
+        reader.seek(-5, io.SEEK_END)
+        assert reader.tell() == len(DATA) - 5
+        assert reader.read() == DATA[-5:]
+        assert reader.read(10) == b''
+
+
+def test_zero_length_items_read_as_empty(stored):
+    with stored.read_media('empty') as reader:
+        assert reader.read() == b''
+        reader.seek(0, io.SEEK_END)
+        assert reader.tell() == 0
+
+
+def test_missing_title_has_no_reader(stored):
+    assert stored.read_media('nothing') is None
+
+
+def test_object_files_are_mapped(make_manager, write_file):
+    manager = make_manager(storage='file')
+    manager.import_file('mp4', 'clip', write_file('clip.mp4', DATA))
+
+    with manager.read_media('clip') as reader:
+        assert isinstance(reader, mmap.mmap)
+        assert reader[CHUNK_SIZE - 3:CHUNK_SIZE + 3] == DATA[CHUNK_SIZE - 3:CHUNK_SIZE + 3]
+        assert len(reader) == len(DATA)
+
+
+def test_blob_reader_works_as_a_raw_stream(make_manager, write_file):
+    manager = make_manager()
+    manager.import_file('mp4', 'clip', write_file('clip.mp4', DATA))
+
+    reader = manager.read_media('clip')
+    assert isinstance(reader, BlobReader)
+    assert (reader.readable(), reader.seekable()) == (True, True)
+    buffer = bytearray(300)
+    reader.seek(CHUNK_SIZE - 100)
+    assert reader.readinto(buffer) == 300
+    assert bytes(buffer) == DATA[CHUNK_SIZE - 100:CHUNK_SIZE + 200]
+
+    with io.BufferedReader(reader, buffer_size=4096) as buffered:
+        buffered.seek(10)
+        assert buffered.read(5000) == DATA[10:5010]
+        buffered.seek(len(DATA) - 3)
+        assert buffered.read() == DATA[-3:]
+    assert reader.closed
+    # Closing twice is harmless
+    reader.close()
+
+
+def test_blob_reader_keeps_working_after_the_manager_reads_elsewhere(make_manager, write_file):
+    manager = make_manager()
+    manager.import_file('mp4', 'clip', write_file('clip.mp4', DATA))
+    manager.import_file('pdf', 'notes', write_file('notes.pdf', b'%PDF-1.4\n'))
+
+    with manager.read_media('clip') as reader:
+        reader.seek(100)
+        assert manager.get_media_data('notes') == b'%PDF-1.4\n'
+        assert manager.search_media(None, 'notes') == [('notes', 'pdf')]
+        assert reader.read(50) == DATA[100:150]
@@ -0,0 +1,55 @@
+import pytest
+
+
+@pytest.fixture
+def catalogue(make_manager, write_file):
+    manager = make_manager()
+    path = write_file('notes.pdf', b'%PDF-1.4\nshared')
+    for title in ('ÄPFEL Kurs', 'äpfel kurs 2', 'Apfel', '100% done', '1000 done', 'a_b', 'axb', 'Ärger', 'zebra'):
+        manager.import_file('pdf', title, path)
+    return manager
+
+
+def test_non_ascii_titles_match_regardless_of_case(catalogue):
+    assert sorted(catalogue.search_media(None, 'äpf')) == [('ÄPFEL Kurs', 'pdf'), ('äpfel kurs 2', 'pdf')]
+    assert catalogue.search_page(None, 'äpf') == [('ÄPFEL Kurs', 'pdf'), ('äpfel kurs 2', 'pdf')]
+    assert catalogue.search_page(None, 'ÄPF') == catalogue.search_ranked('äpf')
+
+
+@pytest.mark.parametrize('term', ['äpf', 'ÄPF', 'Kurs', '%', '0%', '_', 'a_', 'ä', 'Ä', 'A', 'x', '% d', '0_', ''])
+def test_catalogue_matches_the_database(catalogue, term):
+    expected = sorted(catalogue.search_media(None, term, lazy=True))
+    assert sorted(catalogue.search_media(None, term)) == expected
+    assert catalogue.search_page(None, term, limit=100) == expected
+
+
+def test_search_page_walks_the_catalogue_in_title_order(catalogue):
+    titles, after = [], None
+    while page := catalogue.search_page(None, '', after, limit=2):
+        titles += [title for title, _ in page]
+        after = page[-1][0]
+    assert titles == sorted(title for title, _ in catalogue.search_media(None, '', lazy=True))
+
+    catalogue.rename_media('zebra', 'Aardvark')
+    assert catalogue.search_page(None, '', limit=1) == [('100% done', 'pdf')]
+    assert catalogue.search_page('pdf', 'aard') == [('Aardvark', 'pdf')]
+
+
+def test_cached_results_are_capped_by_row_count(catalogue, monkeypatch):
+    monkeypatch.setattr('media_manager.CATALOGUE_RESULT_ROWS', 12)
+    for term in ('a', 'e', 'd', 'k'):
+        catalogue.search_media(None, term)
+    assert catalogue.catalogue.result_rows <= 12
+    assert catalogue.catalogue.result_rows == sum(len(rows) for rows in catalogue.catalogue.results.values())
+
+
+def test_half_read_lazy_listing_does_not_hide_new_media(catalogue, write_file):
+    listing = catalogue.search_media(None, '', lazy=True, batch_size=2)
+    next(listing)
+
+    catalogue.import_file('pdf', 'fresh', write_file('fresh.pdf', b'%PDF-1.4\nfresh'))
+
+    assert ('fresh', 'pdf') in catalogue.search_media(None, 'fresh')
+    assert catalogue.get_media_info('fresh')['title'] == 'fresh'
+    assert catalogue.get_media_data('fresh') == b'%PDF-1.4\nfresh'
+    listing.close()
@@ -0,0 +1,12 @@
+import os
+
+
+def test_large_ingest_does_not_leave_a_large_wal(make_manager, write_file, monkeypatch, tmp_path):
+    limit = 1024 * 1024
+    monkeypatch.setattr('media_manager.WAL_SIZE_LIMIT', limit)
+    manager = make_manager()
+    for i in range(2):
+        manager.import_file('pdf', f'A{i}', write_file(f'a{i}.pdf', b'%PDF-1.4\n' + os.urandom(3 * limit)))
+
+    assert os.path.getsize(tmp_path / 'media_manager.db-wal') <= limit
+    assert manager.get_media_data('A1')[:9] == b'%PDF-1.4\n'